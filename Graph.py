@@ -1,26 +1,51 @@
-import mlbgame
 import nflgame
 import random
 import numpy as np
 from sklearn.linear_model import LogisticRegression
 from collections import defaultdict
+from csr_graph import CSRGraph
+from gametable import GameTable
+import sportsdata
+import centrality
+from folds import run_folds
+import instrument
 
-#Adds the values in dict1 to dict2 and returns it
-def add(dict1, dict2):
-    out=defaultdict(int)
-    for key in dict1:
-        if key not in dict2:
-            out[key]=dict1[key]
-    for key in dict2:
-        out[key]=dict1[key]+dict2[key]
-    return out
 class Graph(object):
     
-    #Edge list is a list of edges from winners to losers
-    def __init__(self, edge_list,hits=False):
+    #Edge list is a list of edges from winners to losers, or a gametable.GameTable whose majority winners
+    #(GameTable.edge_list) become the edges.
+    #backend='csr' keeps the graph as a csr_graph.CSRGraph (dense ids, sorted neighbor arrays) instead of
+    #the two dicts below, which is much smaller and faster for large graphs
+    def __init__(self, edge_list,hits=False,backend='dict'):
+        self._build(edge_list,backend)
+        self.hits=None
+        self._hits_vectors=None
+        self.use_hits=hits
+        self.games=None#Set up by the first add_edge/remove_edge, maps node -> {neighbor: games played}
+        self.features=None#Set up along with games, maps (node1, node2) -> partial triad counts in sorted key order
+        attrs,labels=self.get_all_features(hits=hits)
+        self.model=LogisticRegression()
+        with instrument.span('graph.fit'):
+            self.model.fit(attrs,labels)
+    
+    #Sets up csr or the edge_list/edge_weights dicts from the edges given to __init__
+    @instrument.timed('graph.build')
+    def _build(self,edge_list,backend):
+        self.csr=None
+        self._compact=None
         self.edge_list={}#Maps ids to lists of neigbhors
 
         self.edge_weights={}#Maps tuples of (node1, node2) to True or False, True means node1 beat node2, False means node2 beat node1
+        if backend=='csr':
+            if isinstance(edge_list,GameTable):
+                self.csr=CSRGraph.from_ids(edge_list.teams,*edge_list.majority_ids())
+            else:
+                self.csr=CSRGraph.from_edge_list(edge_list)
+            edge_list=[]
+        elif backend!='dict':
+            raise ValueError("Unknown backend: "+str(backend))
+        elif isinstance(edge_list,GameTable):
+            edge_list=edge_list.edge_list()
         for edge in edge_list:
             if edge[0] not in self.edge_list:
                 self.edge_list[edge[0]]=[]
@@ -30,13 +55,11 @@ class Graph(object):
             self.edge_list[edge[1]].append(edge[0])
             self.edge_weights[edge]=True
             self.edge_weights[(edge[1],edge[0])]=False
-        self.hits=None
-        attrs,labels=self.get_all_features(hits=hits)
-        self.model=LogisticRegression()
-        self.model.fit(attrs,labels)
-    
+
     #Returns a dictionary of types of triads starting at node1, going to intermediarary, node2, and then node1 mapped to counts
     def get_triads(self,node1,node2):        
+        if self.csr is not None:
+            return self.csr.get_triads(node1,node2)
         triads=defaultdict(int)#types of triads to counts, e.g. (True, False, True):4
         if node1 not in self.edge_list[node2]:
             return triads
@@ -45,14 +68,19 @@ class Graph(object):
                 triads[(self.edge_weights[(node1,neigh1)],self.edge_weights[(neigh1,node2)],self.edge_weights[(node2,node1)])]+=1
         return triads
         
-    def get_all_triads(self):
-        triads=defaultdict(int)
-        for node in self.edge_list:
-            for neigh in self.edge_list[node]:
-                triads=add(triads,self.get_triads(node,neigh))
-        return triads
+    #Counts every triad in the graph with csr_graph.CSRGraph.triad_census, summing get_triads over every game in
+    #both directions. per_node/per_edge also return count arrays, rows follow the ids and slots of self.compact()
+    def get_all_triads(self,per_node=False,per_edge=False):
+        return self.compact().triad_census(per_node=per_node,per_edge=per_edge)
+    
+    #Estimates get_all_triads from a random sample of the games, see csr_graph.CSRGraph.estimate_triad_census.
+    #Returns (triads, intervals, drawn) with the estimated counts, their (low, high) confidence bounds and the sample size
+    def estimate_triads(self,samples=None,rel_error=None,confidence=0.95,seed=None):
+        return self.compact().estimate_triad_census(samples,rel_error,confidence,seed)
     
     def get_partial_triads(self,node1,node2):
+        if self.csr is not None:
+            return self.csr.get_partial_triads(node1,node2)
         triads={(True,True):0,(True,False):0,(False,True):0,(False,False):0}
         for neigh1 in self.edge_list[node1]:
             if node2 in self.edge_list[neigh1]:
@@ -60,29 +88,203 @@ class Graph(object):
         return triads
     
     #Returns a numpy array of features and labels, note that the ordering of the features is done by sorting the keys
-    def get_all_features(self,hits=False):
+    #bulk=True computes the partial triads of every edge at once from sparse matrix products, bulk=False walks the
+    #edges one at a time with get_partial_triads. Both give one row per game in each direction.
+    @instrument.timed('graph.features')
+    def get_all_features(self,hits=False,bulk=True):
+        if hits and self.hits==None:
+            self.hits=self.hits_scores()
+        if bulk:
+            return self._bulk_features(hits)
+        num_rows=sum(len(neighs) for neighs in self.edge_list.values()) if self.csr is None else int(self.csr.mult.sum())
+        attrs=np.zeros((num_rows,6 if hits else 4))
+        labels=np.zeros((num_rows))
+        for i,(node,neigh) in enumerate(self.directed_edges()):
+            attrs[i,:4]=[item[1] for item in sorted(self.get_partial_triads(node,neigh).items())]
+            if hits:
+                attrs[i,4]=self.hits[node]
+                attrs[i,5]=self.hits[neigh]
+            labels[i]=1*self.beat(node,neigh)
+        return attrs,labels
+
+    def _bulk_features(self,hits):
+        csr=self.compact()
+        rows=csr.rows()
+        triads=csr.slot_partial_triads()
+        attrs=np.zeros((int(csr.mult.sum()),6 if hits else 4))
+        attrs[:,:4]=np.repeat(triads,csr.mult,axis=0)
         if hits:
-            attrs=np.zeros((0,6))
-            if self.hits==None:
-                self.hits=HITS(self.edge_list.keys(),self.edge_list)
+            scores=np.array([self.hits[name] for name in csr.names])
+            attrs[:,4]=np.repeat(scores[rows],csr.mult)
+            attrs[:,5]=np.repeat(scores[csr.indices],csr.mult)
+        labels=np.repeat(1.0*csr.sign,csr.mult)
+        return attrs,labels
+
+    #HITS authorities of the directed win graph (see HITS), scaled to sum to 100. Repeated calls warm start from
+    #the previous scores, which after a few add_edge calls converges in a handful of iterations
+    @instrument.timed('graph.hits')
+    def hits_scores(self):
+        csr=self.compact()
+        won=csr.sign
+        start=self._hits_vectors
+        if start is not None and len(start[0])!=csr.num_nodes():
+            start=None
+        hubs,authorities,iterations=centrality.hits(csr.num_nodes(),csr.indices[won],csr.rows()[won],csr.mult[won],
+                                                    hubs=None if start is None else start[0],
+                                                    authorities=None if start is None else start[1])
+        self._hits_vectors=(hubs,authorities)
+        return scale_scores(csr.names,authorities)
+
+    #The graph as a CSRGraph, built from the dicts (and kept until the next update) when using the dict backend
+    def compact(self):
+        if self.csr is not None:
+            return self.csr
+        if self._compact is None:
+            self._compact=CSRGraph.from_dicts(self.edge_list,self.edge_weights)
+        return self._compact
+
+    #Yields (node, neigh) once per game in each direction
+    def directed_edges(self):
+        if self.csr is None:
+            for node in self.edge_list:
+                for neigh in self.edge_list[node]:
+                    yield (node,neigh)
+        else:
+            names=self.csr.names
+            rows=self.csr.rows()
+            for row,col,mult in zip(rows,self.csr.indices,self.csr.mult):
+                for i in range(mult):
+                    yield (names[row],names[col])
+
+    #True if node1 beat node2, i.e. edge_weights[(node1,node2)]
+    def beat(self,node1,node2):
+        if self.csr is None:
+            return self.edge_weights[(node1,node2)]
+        pos=self.csr.slot(self.csr.ids[node1],self.csr.ids[node2])
+        if pos<0:
+            raise KeyError((node1,node2))
+        return bool(self.csr.sign[pos])
+
+    #Adds one game won by winner against loser. Only the partial triads of pairs around the two endpoints
+    #are touched, so this costs time proportional to their degrees. Call refit() to update the model.
+    def add_edge(self,winner,loser):
+        if winner==loser:
+            raise ValueError("A team cannot play itself: "+str(winner))
+        self._start_updates()
+        self._compact=None
+        existed=loser in self.games.get(winner,{})
+        if existed:
+            self._update_pair_features(winner,loser,-1)
+        for node in (winner,loser):
+            if node not in self.edge_list:
+                self.edge_list[node]=[]
+                self.games[node]={}
+        self.edge_list[winner].append(loser)
+        self.edge_list[loser].append(winner)
+        self.games[winner][loser]=self.games[winner].get(loser,0)+1
+        self.games[loser][winner]=self.games[loser].get(winner,0)+1
+        self.edge_weights[(winner,loser)]=True
+        self.edge_weights[(loser,winner)]=False
+        if not existed:
+            self.features[(winner,loser)]=self._pair_features(winner,loser)
+            self.features[(loser,winner)]=self._pair_features(loser,winner)
+        self._update_pair_features(winner,loser,1)
+
+    #Removes one game between winner and loser. The pair keeps its current sign until its last game is removed.
+    def remove_edge(self,winner,loser):
+        self._start_updates()
+        if loser not in self.games.get(winner,{}):
+            raise KeyError((winner,loser))
+        self._compact=None
+        self._update_pair_features(winner,loser,-1)
+        self.edge_list[winner].remove(loser)
+        self.edge_list[loser].remove(winner)
+        self.games[winner][loser]-=1
+        self.games[loser][winner]-=1
+        if self.games[winner][loser]==0:
+            del self.games[winner][loser]
+            del self.games[loser][winner]
+            del self.edge_weights[(winner,loser)]
+            del self.edge_weights[(loser,winner)]
+            del self.features[(winner,loser)]
+            del self.features[(loser,winner)]
         else:
-            attrs=np.zeros((0,4))
-        labels=np.zeros((0))
+            self._update_pair_features(winner,loser,1)
+
+    #Refits the model on the current graph. With warm_start the fit starts from the previous coefficients,
+    #which needs a solver that supports it, so the model becomes an lbfgs LogisticRegression.
+    def refit(self,warm_start=True):
+        if self.use_hits:
+            self.hits=None
+        attrs,labels,weights=self._pair_feature_arrays()
+        model=LogisticRegression(solver='lbfgs',warm_start=True) if warm_start else LogisticRegression()
+        if warm_start and hasattr(self.model,'coef_'):
+            model.coef_=self.model.coef_.copy()
+            model.intercept_=self.model.intercept_.copy()
+        with instrument.span('graph.fit'):
+            model.fit(attrs,labels,sample_weight=weights)
+        self.model=model
+        return model
+
+    def _start_updates(self):
+        if self.csr is not None:
+            raise ValueError("add_edge and remove_edge need backend='dict'")
+        if self.games is not None:
+            return
+        self.games={}
         for node in self.edge_list:
+            self.games[node]=defaultdict(int)
             for neigh in self.edge_list[node]:
-                cur_attrs=sorted(self.get_partial_triads(node,neigh).items())
-                if hits:
-                    cur_attrs=[item[1] for item in cur_attrs]
-                    cur_attrs.extend([self.hits[node],self.hits[neigh]])
-                    cur_attrs=np.array(cur_attrs).reshape((1,6))
-                else:
-                    cur_attrs=np.array([item[1] for item in cur_attrs])
-                    cur_attrs=cur_attrs.reshape((1,4))
-                attrs=np.append(attrs,cur_attrs,axis=0)
-                labels=np.append(labels,1*self.edge_weights[(node,neigh)])
-        return attrs,labels
+                self.games[node][neigh]+=1
+            self.games[node]=dict(self.games[node])
+        csr=self.compact()
+        triads=csr.slot_partial_triads().astype(np.int64)
+        self.features={}
+        for row,col,counts in zip(csr.rows(),csr.indices,triads):
+            self.features[(csr.names[row],csr.names[col])]=counts
+
+    #Partial triads of (node1,node2) from games, as an array in sorted key order
+    def _pair_features(self,node1,node2):
+        counts=np.zeros(4,dtype=np.int64)
+        for neigh,played in self.games[node1].items():
+            if node2 in self.games[neigh]:
+                counts[2*self.edge_weights[(node1,neigh)]+self.edge_weights[(neigh,node2)]]+=played
+        return counts
+
+    #Adds (sign=1) or removes (sign=-1) the terms the pair a-b contributes to the partial triads of other pairs:
+    #a -> b -> v and b -> a -> v for the pairs (a,v) and (b,v), u -> a -> b and u -> b -> a for (u,b) and (u,a)
+    def _update_pair_features(self,a,b,sign):
+        games=self.games
+        for x,y in ((a,b),(b,a)):
+            played=games[x][y]
+            won=self.edge_weights[(x,y)]
+            for v in games[y]:
+                if v!=x and v in games[x]:
+                    self.features[(x,v)][2*won+self.edge_weights[(y,v)]]+=sign*played
+            for u in games[x]:
+                if u!=y and y in games[u]:
+                    self.features[(u,y)][2*self.edge_weights[(u,x)]+won]+=sign*games[u][x]
+
+    #One row per pair with the number of games between them as the sample weight
+    def _pair_feature_arrays(self):
+        if self.features is None:
+            attrs,labels=self.get_all_features(hits=self.use_hits)
+            return attrs,labels,np.ones(len(labels))
+        if self.use_hits and self.hits==None:
+            self.hits=self.hits_scores()
+        pairs=list(self.features.keys())
+        attrs=np.zeros((len(pairs),6 if self.use_hits else 4))
+        labels=np.zeros(len(pairs))
+        weights=np.zeros(len(pairs))
+        for i,(node1,node2) in enumerate(pairs):
+            attrs[i,:4]=self.features[(node1,node2)]
+            if self.use_hits:
+                attrs[i,4]=self.hits[node1]
+                attrs[i,5]=self.hits[node2]
+            labels[i]=1*self.edge_weights[(node1,node2)]
+            weights[i]=self.games[node1][node2]
+        return attrs,labels,weights
 
-        
     def predict(self,node1,node2,model=None):
         cur_attrs=sorted(self.get_partial_triads(node1,node2).items())
         if self.hits:
@@ -98,91 +300,105 @@ class Graph(object):
             print "Using foreign model"
             return model.predict(cur_attrs)
 
+    #Predicts every (node1, node2) in pairs with one feature pass and one model call. Returns the probability that
+    #node1 beats node2 when proba is True, the predicted labels (1 means node1 wins) otherwise.
+    #Teams that are not in the graph get all-zero features.
+    @instrument.timed('graph.predict')
+    def predict_many(self,pairs,proba=True,model=None):
+        csr=self.compact()
+        pairs=list(pairs)
+        u=csr.lookup([pair[0] for pair in pairs])
+        v=csr.lookup([pair[1] for pair in pairs])
+        attrs=np.zeros((len(pairs),6 if self.hits else 4))
+        attrs[:,:4]=csr.pair_partial_triads(u,v)
+        if self.hits:
+            #The trailing zero is the score looked up by the id -1 of unknown teams
+            scores=np.append([self.hits.get(name,0.0) for name in csr.names],0.0)
+            attrs[:,4]=scores[u]
+            attrs[:,5]=scores[v]
+        if model==None:
+            model=self.model
+        if not proba:
+            return model.predict(attrs)
+        return model.predict_proba(attrs)[:,list(model.classes_).index(1)]
+
 #Returns a length k list of 2 tuples where the first element of each tuple is a list of training examples
 #and the second is a list of test examples
 def k_folds(edge_list,k=20):
     random.shuffle(edge_list)
-    out=[]
+    return [fold(edge_list,i,k) for i in range(k)]
+
+#Returns the i-th (train, test) split of an already shuffled edge list
+def fold(edge_list,i,k):
     fold_size=float(len(edge_list)/k)
-    for i in range(k):
-        test=edge_list[int(i*fold_size):int((i+1)*fold_size)]
-        train=edge_list[:int(i*fold_size)]
-        train.extend(edge_list[int((i+1)*fold_size):])
-        out.append((train,test))
-    return out
-        
-def eval_acc(edge_list,model=None,hits=False):
-    folds=k_folds(edge_list)
-    accs=[]
-    for fold in folds:
-        g=Graph(fold[0],hits=hits)
-        correct=0
-        wrong=0
-        for edge in fold[1]:
-            if g.predict(edge[0],edge[1],model)==1:
-                correct+=1
-            else:
-                wrong+=1
-            if g.predict(edge[1],edge[0])==0:
-                correct+=1
-            else:
-                wrong+=1            
-        accs.append(float(correct)/(correct+wrong))
+    test=edge_list[int(i*fold_size):int((i+1)*fold_size)]
+    train=edge_list[:int(i*fold_size)]
+    train.extend(edge_list[int((i+1)*fold_size):])
+    return (train,test)
+
+#Set in each worker process once by _init_fold_worker, so tasks only carry a fold index
+_fold_state=None
+
+def _init_fold_worker(state):
+    global _fold_state
+    _fold_state=state
+
+#Trains on fold i and returns its accuracy. Both generators are reseeded per fold so that serial and
+#parallel runs give the same results.
+@instrument.timed('eval.fold')
+def _eval_fold(i):
+    edge_list,k,model,hits,backend,seed=_fold_state
+    random.seed(seed+i)
+    np.random.seed(seed+i)
+    train,test=fold(edge_list,i,k)
+    g=Graph(train,hits=hits,backend=backend)
+    forward=g.predict_many(test,proba=False,model=model)
+    backward=g.predict_many([(edge[1],edge[0]) for edge in test],proba=False)
+    correct=np.sum(forward==1)+np.sum(backward==0)
+    return float(correct)/(2*len(test))
+
+#k-fold accuracy of Graph on edge_list. workers>1 evaluates the folds in a process pool, seed fixes the
+#per-fold seeds (drawn from random when not given) so the result does not depend on workers.
+@instrument.timed('eval.eval_acc')
+def eval_acc(edge_list,model=None,hits=False,backend='dict',k=20,workers=1,seed=None):
+    random.shuffle(edge_list)
+    if seed is None:
+        seed=random.randint(0,2**30)
+    accs=run_folds(_eval_fold,_init_fold_worker,(edge_list,k,model,hits,backend,seed),k,workers)
     print sum(accs)/len(accs)
+    return sum(accs)/len(accs)
 
+#Games of pairs that split their games evenly are dropped, and every other game counts for the team that won the
+#majority of them, see gametable.GameTable.edge_list
 def mlb_edge_list(year):
-    teams = [ team.club.upper() for team in mlbgame.teams() ]
-    edge_list=[]
-    edge_weights={}
-    games = mlbgame.combine_games(mlbgame.games(year))
-    team_dict = { team.club_common_name : team.club.upper() for team in mlbgame.teams() }
-    for game in games:
-        try:
-            if str(game.w_team) not in team_dict or str(game.l_team) not in team_dict:
-                continue
-            w_team=team_dict[game.w_team]
-            l_team=team_dict[game.l_team]
-            if (str(w_team),str(l_team)) in edge_list:
-                edge_weights[(str(w_team),str(l_team))]+=1
-            else:
-                edge_weights[(str(w_team),str(l_team))]=1#abs(game.score_home-game.score_away)
-            edge_list.append((str(w_team),str(l_team)))
-        except AttributeError:
-            pass
-    new_edge_list=[]
-    for winner,loser in edge_list:
-        if (loser,winner) not in edge_weights or edge_weights[(winner,loser)]>edge_weights[(loser,winner)]:
-            new_edge_list.append((winner,loser))
-    return new_edge_list
+    return sportsdata.getMLBTable(year).edge_list()
 
 def nfl_edge_list(year):
     teams = [ str(team[0]) for team in nflgame.teams ]
-    games=nflgame.games(year)
-    edge_list=[]
-    for game in games:
-        if game.winner in teams and game.loser in teams:
-            edge_list.append((str(game.winner),str(game.loser)))
-    return edge_list
-
-def HITS(nodes,edge_list):
-    authorities={}
-    hubs={}
-    for node in nodes:
-        authorities[node]=1.0
-    for i in range(100):
-        total_auth=0.0
-        for node in edge_list:
-            authorities[node]+=sum([authorities[neigh] for neigh in edge_list[node]])
-            total_auth+=sum([authorities[neigh] for neigh in edge_list[node]])
-        for node in edge_list:
-            authorities[node]/=(total_auth**.5)
-    total=0.0
-    for node in edge_list:
-        total+=authorities[node]
+    table=sportsdata.getNFLTable(year).between(teams)
+    return table.select(~table.games['tie']).pairs()
+
+#Returns a dictionary of HITS authority scores, scaled to sum to 100. Every game is an edge from the loser to the
+#winner, so a team gets authority by beating teams that are good hubs, i.e. teams that lost to strong teams.
+#edge_list maps nodes to lists of neighbors as in Graph and edge_weights gives the signs; without edge_weights every
+#game points both ways and hubs and authorities are the same. kwargs go to centrality.hits.
+def HITS(nodes,edge_list,edge_weights=None,**kwargs):
+    sources=[]
+    targets=[]
     for node in edge_list:
-        authorities[node]/=total/100
-    return authorities
+        for neigh in edge_list[node]:
+            if edge_weights is None or edge_weights[(node,neigh)]:
+                sources.append(neigh)
+                targets.append(node)
+    names,hubs,authorities,iterations=centrality.hits_by_name(sources,targets,names=list(nodes),**kwargs)
+    return scale_scores(names,authorities)
 
+#Maps names[i] to scores[i], scaled to sum to 100
+def scale_scores(names,scores):
+    total=scores.sum()
+    if total>0:
+        scores=scores/(total/100)
+    return dict(zip(names,scores))
 
 if __name__=='__main__':
 
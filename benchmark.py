@@ -0,0 +1,298 @@
+"""
+Benchmarks for ingestion, graph construction, triad features, centrality and ranking.
+
+Every (case, size) pair runs in a fresh Python process so its peak memory is its own. Inputs
+are seeded synthetic tournaments (syntheticgraph.syntheticTable) of increasing size, or the
+bundled data/mlb/2015 CSVs. Results are written as JSON and can be compared against a
+baseline file written by an earlier run:
+
+    python benchmark.py --output base.json
+    python benchmark.py --baseline base.json --output new.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+MLB_FOLDER = os.path.join(REPO, 'data', 'mlb', '2015')
+DEFAULT_SIZES = [ 100, 1000, 10000 ]
+GAMES_PER_TEAM = 16
+
+def _synthetic(size, seed):
+    import syntheticgraph
+    return syntheticgraph.syntheticTable(size, alpha=0.3, gamesPerTeam=GAMES_PER_TEAM, margin=5.0, seed=seed)
+
+# Setups import the modules their runs use, so import time is not measured
+
+def _setupReadFolder(size, seed):
+    import process_mlb
+    return MLB_FOLDER
+
+def _runReadFolder(folder):
+    import process_mlb
+    process_mlb.read_folder(folder)
+
+def _setupGraph(size, seed):
+    import Graph
+    return _synthetic(size, seed).edge_list()
+
+def _runGraph(edgeList):
+    import Graph
+    Graph.Graph(edgeList)
+
+def _runGraphCSR(edgeList):
+    import Graph
+    Graph.Graph(edgeList, backend='csr')
+
+def _setupFeatures(size, seed):
+    import Graph
+    return Graph.Graph(_synthetic(size, seed).edge_list())
+
+def _runFeatures(graph):
+    graph.get_all_features()
+
+def _setupHITS(size, seed):
+    import Graph
+    import graph_features
+    table = _synthetic(size, seed)
+    nodes, edgeList, edgeWeights = graph_features.table_edges(table)
+    neighbours = {}
+    signs = {}
+    for winner, loser in table.edge_list():
+        neighbours.setdefault(winner, []).append(loser)
+        neighbours.setdefault(loser, []).append(winner)
+        signs[(winner, loser)] = True
+        signs[(loser, winner)] = False
+    return nodes, edgeList, edgeWeights, neighbours, signs
+
+def _runGraphHITS(args):
+    import Graph
+    nodes, edgeList, edgeWeights, neighbours, signs = args
+    Graph.HITS(nodes, neighbours, signs)
+
+def _runFeaturesHITS(args):
+    import graph_features
+    nodes, edgeList, edgeWeights, neighbours, signs = args
+    graph_features.HITS(nodes, edgeList, edgeWeights)
+
+def _setupPageRank(size, seed):
+    import graph_features
+    table = _synthetic(size, seed)
+    ids = table.pairs()
+    labels = (table.games['margin'] > 1).astype(int).tolist()
+    return ids, labels
+
+def _runPageRank(args):
+    import graph_features
+    graph_features.PageRank(*args)
+
+def _setupRanking(size, seed):
+    import ranking
+    import snap
+    table = _synthetic(size, seed)
+    graph = snap.TNGraph.New()
+    for i in range(size):
+        graph.AddNode(i)
+    edgeAttrs = {}
+    for winner, loser, margin in zip(table.games['winner'].tolist(), table.games['loser'].tolist(), table.games['margin'].tolist()):
+        graph.AddEdge(loser, winner)
+        edgeAttrs[(winner, loser)] = margin
+    return graph, edgeAttrs
+
+def _runRanking(args):
+    import random
+    import ranking
+    graph, edgeAttrs = args
+    random.seed(0)
+    ranking.ranking(graph, 0.6, ranking.degreeDifference, ranking.edgeWeightDifference, edgeAttrs)
+
+def _setupEvaluation(size, seed):
+    import ranking
+    table = _synthetic(size, seed)
+    rng = np.random.RandomState(seed)
+    return table, [ rng.permutation(size).tolist() for i in range(100) ]
+
+def _runGameEvaluation(args):
+    import ranking
+    table, rankings = args
+    pairs = table.pairs()
+    for candidate in rankings:
+        ranking.gameRankingEvaluation(pairs, candidate)
+
+def _runBatchEvaluation(args):
+    import ranking
+    table, rankings = args
+    ranking.evaluateRankings(np.array(rankings), table)
+
+def _setupStreaming(size, seed):
+    import streaming
+    pairs = _synthetic(size, seed).pairs()
+    ranker = streaming.StreamingRanker(range(size))
+    ranker.addGames(pairs[:-1])
+    ranker.hits()
+    ranker.pagerank()
+    return ranker, pairs[-1]
+
+def _runStreamingGame(args):
+    # One more game, then the updated ranking and warm started HITS and PageRank
+    ranker, game = args
+    ranker.addGame(*game)
+    ranker.hits()
+    ranker.pagerank()
+
+# name -> (setup(size, seed) -> input, run(input), fixed size or None)
+CASES = OrderedDict([
+    ('read_folder', (_setupReadFolder, _runReadFolder, 'mlb')),
+    ('graph_init', (_setupGraph, _runGraph, None)),
+    ('graph_init_csr', (_setupGraph, _runGraphCSR, None)),
+    ('get_all_features', (_setupFeatures, _runFeatures, None)),
+    ('hits_graph', (_setupHITS, _runGraphHITS, None)),
+    ('hits_graph_features', (_setupHITS, _runFeaturesHITS, None)),
+    ('pagerank', (_setupPageRank, _runPageRank, None)),
+    ('ranking', (_setupRanking, _runRanking, None)),
+    ('game_evaluation_x100', (_setupEvaluation, _runGameEvaluation, None)),
+    ('evaluate_rankings_x100', (_setupEvaluation, _runBatchEvaluation, None)),
+    ('streaming_game', (_setupStreaming, _runStreamingGame, None)),
+])
+
+def _peakRSS():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def runCase(name, size, seed=0, repeat=3):
+    """
+    Runs one case in this process
+
+    Args:
+        name (str): a key of CASES
+        size (int or str): the number of synthetic teams, ignored by cases with a fixed size
+        seed (int): the seed of the synthetic input
+        repeat (int): the number of timed runs
+
+    Returns:
+        A dictionary with the best and median time in seconds, and the peak RSS in kilobytes
+        after setup and after the runs
+    """
+    setup, run, fixed = CASES[name]
+    sys.path.insert(0, REPO)
+    data = setup(size, seed)
+    setupRSS = _peakRSS()
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        run(data)
+        times.append(time.time() - start)
+    return { 'case' : name, 'size' : fixed or size, 'seed' : seed, 'repeat' : repeat,
+             'seconds' : min(times), 'median_seconds' : float(np.median(times)),
+             'setup_rss_kb' : setupRSS, 'peak_rss_kb' : _peakRSS() }
+
+def runIsolated(name, size, seed=0, repeat=3):
+    """
+    Runs one case in a fresh interpreter, see runCase
+
+    Returns:
+        The case result, or a dictionary with an 'error' entry if the process failed
+    """
+    command = [ sys.executable, os.path.abspath(__file__), '--run-case', name, '--size', str(size),
+                '--seed', str(seed), '--repeat', str(repeat) ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=REPO)
+    out, err = process.communicate()
+    lines = out.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        return { 'case' : name, 'size' : size, 'seed' : seed, 'error' : err.strip().splitlines()[-1:] }
+    # Cases may print, the result is the last line
+    return json.loads(lines[-1])
+
+def runSuite(cases=None, sizes=DEFAULT_SIZES, seed=0, repeat=3):
+    """
+    Runs every case at every size, each in its own process
+
+    Returns:
+        A dictionary with the run's metadata under 'meta' and the case results under 'results'
+    """
+    results = []
+    for name in (cases or CASES.keys()):
+        fixed = CASES[name][2]
+        for size in ([ fixed ] if fixed else sizes):
+            result = runIsolated(name, size, seed, repeat)
+            results.append(result)
+            print >> sys.stderr, _formatRow(result)
+    meta = { 'python' : platform.python_version(), 'numpy' : np.__version__, 'platform' : platform.platform(),
+             'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed' : seed, 'repeat' : repeat }
+    return { 'meta' : meta, 'results' : results }
+
+def compare(report, baseline, tolerance=0.25, memoryTolerance=0.25):
+    """
+    Flags the cases that got slower or bigger than in a baseline report
+
+    Args:
+        report (dict): a runSuite report
+        baseline (dict): an earlier runSuite report
+        tolerance (float): the allowed relative increase of the best time
+        memoryTolerance (float): the allowed relative increase of the memory used by the runs
+            (peak minus setup RSS, at least 1 MB)
+
+    Returns:
+        A list of (case, size, metric, baseline value, new value) regressions
+    """
+    old = { (row['case'], str(row['size'])) : row for row in baseline['results'] if 'error' not in row }
+    regressions = []
+    for row in report['results']:
+        key = (row['case'], str(row['size']))
+        if 'error' in row or key not in old:
+            continue
+        before = old[key]
+        if row['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append(key + ('seconds', before['seconds'], row['seconds']))
+        usedBefore = max(before['peak_rss_kb'] - before['setup_rss_kb'], 1024)
+        used = row['peak_rss_kb'] - row['setup_rss_kb']
+        if used > usedBefore * (1 + memoryTolerance):
+            regressions.append(key + ('memory_kb', usedBefore, used))
+    return regressions
+
+def _formatRow(row):
+    if 'error' in row:
+        return '%-24s %8s  error: %s' % (row['case'], row['size'], ' '.join(row['error']))
+    return '%-24s %8s  %10.4fs  %10d kB' % (row['case'], row['size'], row['seconds'], row['peak_rss_kb'] - row['setup_rss_kb'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the ingestion, graph, feature, centrality and ranking code')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES.keys()), help='the cases to run, all by default')
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help='the synthetic tournament sizes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case, the best one is reported')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='a report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown before flagging')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--size', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        size = int(args.size) if args.size.isdigit() else args.size
+        print json.dumps(runCase(args.run_case, size, args.seed, args.repeat))
+        return 0
+
+    report = runSuite(args.cases, args.sizes, args.seed, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.tolerance)
+        for case, size, metric, before, after in regressions:
+            print 'REGRESSION %s %s %s: %s -> %s' % (case, size, metric, before, after)
+        if regressions:
+            return 1
+        print 'No regressions against', args.baseline
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
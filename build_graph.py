@@ -1,6 +1,12 @@
 import process_mlb
 import numpy as np
 import random
+from collections import Mapping
+import instrument
+import sampling
+
+#Graphs with at most this many node pairs look up edges in a dense table of n*n positions
+DENSE_LOOKUP=1<<22
 
 class Graph:
     def __init__(self,nodes,edge_dict):
@@ -12,14 +18,26 @@ class Graph:
         for edge in edge_dict:
             self.edge_list[edge[0]].append(edge[1])
             self.edge_list[edge[1]].append(edge[0])
-    #Returns all triads that involve the given node
+        self._edges=None
+        self._incidence=None
+        self._triads=None
+        self._keys=None
+
+    #Builds the graph of a gametable.GameTable, with edge_dict holding the spreads of GameTable.spread_dict
+    @classmethod
+    def from_table(cls,table,gamma=1.0):
+        return cls(table.teams,table.spread_dict(gamma))
+
+    #Returns all triads that involve the given node, as (node->neigh1, neigh1->neigh2, neigh2->node) weights. A neighbor
+    #is listed once per direction it has in edge_dict, so triads through pairs with both directions repeat
     def get_weighted_triads(self,node):
         triads=[]
         for neigh1 in self.edge_list[node]:
+            if (node,neigh1) not in self.edge_dict:
+                continue
             for neigh2 in self.edge_list[neigh1]:
-                if node in self.edge_list[neigh2] and (neigh1,neigh2):
-                    if (node,neigh1) in self.edge_dict and (neigh1,neigh2) in self.edge_dict and (neigh2,node) in self.edge_dict:
-                        triads.append((self.edge_dict[(node,neigh1)],self.edge_dict[(neigh1,neigh2)],self.edge_dict[(neigh2,node)]))
+                if (neigh1,neigh2) in self.edge_dict and (neigh2,node) in self.edge_dict:
+                    triads.append((self.edge_dict[(node,neigh1)],self.edge_dict[(neigh1,neigh2)],self.edge_dict[(neigh2,node)]))
         return triads
 
     #Just treats them as positive or negative edges, discards edges with weight 0
@@ -37,21 +55,168 @@ class Graph:
             unweighted_triads[signs]=unweighted_triads.get(signs,0)+1
         return unweighted_triads
 
-    #Does this for the whole graph
+    #All keys of edge_dict as parallel arrays in edge_dict order: (keys, src ids, dst ids, weights, key -> position,
+    #name -> id). Fold views share them and pick their edges with a mask over the positions
+    def edge_arrays(self):
+        if self._edges is None:
+            index=dict((node,i) for i,node in enumerate(self.nodes))
+            keys=list(self.edge_dict)
+            src=np.array([index[edge[0]] for edge in keys],dtype=np.int64)
+            dst=np.array([index[edge[1]] for edge in keys],dtype=np.int64)
+            weights=np.array([self.edge_dict[edge] for edge in keys])
+            self._edges=(keys,src,dst,weights,dict((edge,i) for i,edge in enumerate(keys)),index)
+        return self._edges
+
+    #edge_list as CSR arrays over ids: (indptr, neighbor ids, key positions), each node's entries in edge_list order
+    def incidence(self):
+        if self._incidence is None:
+            keys,src,dst,weights,positions,index=self.edge_arrays()
+            ends=np.concatenate((src,dst))
+            order=np.lexsort((np.tile(np.arange(len(keys)),2),ends))
+            indptr=np.concatenate(([0],np.cumsum(np.bincount(ends,minlength=len(self.nodes)))))
+            self._incidence=(indptr,np.concatenate((dst,src))[order],np.tile(np.arange(len(keys)),2)[order])
+        return self._incidence
+
+    #Keys of the graph as id arrays (src, dst, weights), self loops dropped
+    def _directed_arrays(self):
+        keys,src,dst,weights,positions,index=self.edge_arrays()
+        keep=src!=dst
+        return src[keep],dst[keep],weights[keep]
+
+    #Every unordered pair of node ids with a key in edge_dict: (lo, hi, has lo->hi, has hi->lo, weight lo->hi,
+    #weight hi->lo), sorted by lo*n+hi. Self loops never close a triad and are dropped
+    def _pair_arrays(self):
+        n=len(self.nodes)
+        src,dst,weights=self._directed_arrays()
+        lo=np.minimum(src,dst)
+        hi=np.maximum(src,dst)
+        pair_keys,pair=np.unique(lo*n+hi,return_inverse=True)
+        up=src<dst
+        has_up=np.zeros(len(pair_keys),dtype=bool)
+        has_down=np.zeros(len(pair_keys),dtype=bool)
+        w_up=np.zeros(len(pair_keys),dtype=weights.dtype)
+        w_down=np.zeros(len(pair_keys),dtype=weights.dtype)
+        has_up[pair[up]]=True
+        w_up[pair[up]]=weights[up]
+        has_down[pair[~up]]=True
+        w_down[pair[~up]]=weights[~up]
+        return pair_keys//max(n,1),pair_keys%max(n,1),has_up,has_down,w_up,w_down
+
+    #Lists every triangle of the undirected graph once by compact-forward: nodes are ranked by (degree, id), every
+    #pair points from its lower to its higher ranked node, and a triangle u<v<w is found from the edge (u,v) as a
+    #later out neighbor w of u that v also points to. Returns a (triangles, 3) array of node ids
+    def triangles(self,lo,hi,chunk=1<<20):
+        n=len(self.nodes)
+        degree=np.bincount(lo,minlength=n)+np.bincount(hi,minlength=n)
+        order=np.lexsort((np.arange(n),degree))
+        rank=np.empty(n,dtype=np.int64)
+        rank[order]=np.arange(n)
+        a=np.minimum(rank[lo],rank[hi])
+        b=np.maximum(rank[lo],rank[hi])
+        keys=np.sort(a*n+b)
+        a=keys//max(n,1)
+        b=keys%max(n,1)
+        ends=np.searchsorted(a,a,side='right')
+        #Out neighbors of a after b, i.e. the candidates for the third node
+        counts=ends-np.arange(len(keys))-1
+        done=np.concatenate(([0],np.cumsum(counts)))
+        found=[np.zeros((0,3),dtype=np.int64)]
+        start=0
+        while start<len(keys):
+            #A block of edges whose candidates fill about a chunk
+            stop=max(start+1,int(np.searchsorted(done,done[start]+chunk,side='right'))-1)
+            edges=np.repeat(np.arange(start,stop),counts[start:stop])
+            offsets=np.arange(len(edges))-np.repeat(np.cumsum(counts[start:stop])-counts[start:stop],counts[start:stop])
+            third=b[edges+1+offsets]
+            closing=b[edges]*n+third
+            position=np.minimum(np.searchsorted(keys,closing),len(keys)-1)
+            hit=keys[position]==closing
+            found.append(order[np.column_stack((a[edges][hit],b[edges][hit],third[hit]))])
+            start=stop
+        return np.concatenate(found)
+
+    #All weighted triads as arrays, with the triads of get_all_weighted_triads: (owners, weights, counts) where row i
+    #is the triad (owner->x, x->y, y->owner) with those three weights, seen counts[i] times. Each triangle is
+    #enumerated once and expanded into its six rotations and orientations. Kept until the graph changes
+    def weighted_triad_arrays(self):
+        if self._triads is not None:
+            return self._triads
+        lo,hi,has_up,has_down,w_up,w_down=self._pair_arrays()
+        n=len(self.nodes)
+        pair_keys=lo*n+hi
+        multiplicity=has_up.astype(np.int64)+has_down
+        triangles=self.triangles(lo,hi)
+        def directed(u,v):
+            pair=np.searchsorted(pair_keys,np.minimum(u,v)*n+np.maximum(u,v))
+            up=u<v
+            return np.where(up,has_up[pair],has_down[pair]),np.where(up,w_up[pair],w_down[pair]),multiplicity[pair]
+        owners=[]
+        weights=[]
+        counts=[]
+        for p,q,r in ((0,1,2),(1,2,0),(2,0,1),(0,2,1),(2,1,0),(1,0,2)):
+            x,y,z=triangles[:,p],triangles[:,q],triangles[:,r]
+            has1,w1,m1=directed(x,y)
+            has2,w2,m2=directed(y,z)
+            has3,w3,m3=directed(z,x)
+            present=has1&has2&has3
+            owners.append(x[present])
+            weights.append(np.column_stack((w1,w2,w3))[present])
+            counts.append((m1*m2)[present])
+        self._triads=(np.concatenate(owners),np.concatenate(weights).reshape(-1,3),np.concatenate(counts))
+        return self._triads
+
+    #Yields (node, triad) for every weighted triad of the graph, repeats included as in get_weighted_triads
+    def iter_weighted_triads(self):
+        owners,weights,counts=self.weighted_triad_arrays()
+        for owner,triad,count in zip(owners.tolist(),weights.tolist(),counts.tolist()):
+            for i in range(count):
+                yield self.nodes[owner],tuple(triad)
+
+    #Does this for the whole graph, one list per node in the order of nodes
     def get_all_weighted_triads(self):
-        triads=[]
-        for node in self.nodes:
-            triads.append(self.get_weighted_triads(node))
+        index=dict((node,i) for i,node in enumerate(self.nodes))
+        triads=[[] for node in self.nodes]
+        for node,triad in self.iter_weighted_triads():
+            triads[index[node]].append(triad)
         return triads
+
     #Gets for whole graph
     def get_all_unweighted_triads(self):
+        owners,weights,counts=self.weighted_triad_arrays()
+        signed=np.all(weights!=0,axis=1)
+        codes=np.dot(weights[signed]>0,[4,2,1])
+        totals=np.bincount(codes,weights=counts[signed],minlength=8)
         triads={}
-        for node in self.nodes:
-            t=self.get_unweighted_triads(node)
-            for k1,k2,k3 in t:
-                triads[(k1,k2,k3)]=triads.get((k1,k2,k3),0)+t[(k1,k2,k3)]
+        for code in range(8):
+            if totals[code]>0:
+                triads[(code&4>0,code&2>0,code&1>0)]=int(totals[code])
         return triads
     
+    #Estimates get_all_unweighted_triads from a random sample of the keys with a nonzero weight, each counting the
+    #triads it closes, so only the sampled keys' paths are visited. samples caps the keys drawn and rel_error stops
+    #once every type is known to that relative error, see sampling.estimate_totals. Returns (triads, intervals, drawn)
+    #where triads maps each type seen to its estimated count and intervals to its (low, high) confidence bounds
+    def estimate_unweighted_triads(self,samples=None,rel_error=None,confidence=0.95,seed=None):
+        src,dst,weights=self._directed_arrays()
+        keep=weights!=0
+        closers,starts,signs=src[keep],dst[keep],weights[keep]>0
+        key_weights,counts=self._key_arrays()[2:4]
+        def values(sample):
+            #Triads starting -> w -> closer -> starting for the sampled (closer, starting) keys
+            out=np.zeros((len(sample),8))
+            for start,stop,rows,first,second in self._paths(starts[sample],closers[sample]):
+                codes=8*rows+4*(key_weights[first]>0)+2*(key_weights[second]>0)+signs[sample][start:stop][rows]
+                out[start:stop]=np.bincount(codes,weights=counts[first]*counts[second],minlength=8*(stop-start)).reshape(-1,8)
+            return out
+        estimate,lower,upper,drawn=sampling.estimate_totals(len(closers),values,samples,rel_error,confidence,seed)
+        triads={}
+        intervals={}
+        for code in range(8):
+            if estimate[code]>0:
+                triads[(code&4>0,code&2>0,code&1>0)]=estimate[code]
+                intervals[(code&4>0,code&2>0,code&1>0)]=(lower[code],upper[code])
+        return triads,intervals,drawn
+
     def get_unweighted_attrs_and_labels(self):
         triads=self.get_all_unweighted_triads()
         attrs=np.zeros((len(triads),2))
@@ -81,29 +246,202 @@ class Graph:
                     partial.append((self.edge_dict[(node1,neigh)]>0,self.edge_dict[(neigh,node2)]>0))
         return partial
 
-    #returns a length k tuple of (graph, [(node1,node2,edge_weight)...]) where node1 and node2 are nodes that previously had an edge between them 
-    #with weight/sign edge_weight, but it was removed so is now test data
+    #The keys of edge_dict with a nonzero weight in CSR form, sorted by (src, dst): (indptr, dst, weights, counts, keys)
+    #where counts is how many directions src and dst have in edge_dict, i.e. how often get_unweighted_partial_triads
+    #sees dst from src, and keys is src*n+dst. Kept until the graph changes
+    def _key_arrays(self):
+        if self._keys is None:
+            n=len(self.nodes)
+            src,dst,weights=self._directed_arrays()
+            all_keys=np.sort(src*n+dst)
+            reverse=dst*n+src
+            position=np.minimum(np.searchsorted(all_keys,reverse),max(len(all_keys)-1,0))
+            counts=1+(all_keys[position]==reverse)
+            order=np.lexsort((dst,src))
+            order=order[weights[order]!=0]
+            indptr=np.concatenate(([0],np.cumsum(np.bincount(src[order],minlength=n))))
+            self._keys=(indptr,dst[order],weights[order],counts[order],src[order]*n+dst[order])
+        return self._keys
+
+    #get_unweighted_partial_triads for many pairs at once, as counts of each (node1->neigh, neigh->node2) sign pair
+    #with columns (False,False), (False,True), (True,False), (True,True). With weighted=True four more columns, in the
+    #same order, sum |weight(node1,neigh)|*|weight(neigh,node2)| over the same paths. Every out key of node1 is joined
+    #with the key from its end to node2 by binary search, for blocks of pairs covering about chunk keys
+    def pair_partial_triads(self,node1s,node2s,chunk=1<<20,weighted=False):
+        index=self.edge_arrays()[5]
+        u=np.array([index[node] for node in node1s],dtype=np.int64)
+        v=np.array([index[node] for node in node2s],dtype=np.int64)
+        return self.pair_partial_triads_ids(u,v,chunk,weighted)
+
+    #pair_partial_triads for id arrays
+    def pair_partial_triads_ids(self,u,v,chunk=1<<20,weighted=False):
+        indptr,dst,weights,counts,keys=self._key_arrays()
+        out=np.zeros((len(u),8 if weighted else 4))
+        for start,stop,rows,first,second in self._paths(u,v,chunk):
+            codes=4*rows+2*(weights[first]>0)+(weights[second]>0)
+            out[start:stop,:4]=np.bincount(codes,weights=counts[first],minlength=4*(stop-start)).reshape(-1,4)
+            if weighted:
+                margins=counts[first]*np.abs(weights[first])*np.abs(weights[second])
+                out[start:stop,4:]=np.bincount(codes,weights=margins,minlength=4*(stop-start)).reshape(-1,4)
+        return out
+
+    #Yields (start, stop, rows, first, second) for blocks of the pairs (u[i],v[i]) covering about chunk keys: every
+    #path u -> w -> v of nonzero keys in the block, as the pair's row within the block and the _key_arrays positions
+    #of its two keys. Every out key of u is joined with the key from its end to v
+    def _paths(self,u,v,chunk=1<<20):
+        n=len(self.nodes)
+        indptr,dst,weights,counts,keys=self._key_arrays()
+        if len(keys)==0:
+            return
+        positions=None
+        if n*n<=DENSE_LOOKUP:
+            #Small graphs look keys up in a dense table, which beats binary search on random probes
+            positions=np.full(n*n,-1,dtype=np.int32)
+            positions[keys]=np.arange(len(keys))
+        degree=indptr[u+1]-indptr[u]
+        done=np.concatenate(([0],np.cumsum(degree)))
+        start=0
+        while start<len(u):
+            stop=max(start+1,int(np.searchsorted(done,done[start]+chunk,side='right'))-1)
+            block=degree[start:stop]
+            rows=np.repeat(np.arange(stop-start),block)
+            first=np.repeat(indptr[u[start:stop]],block)+np.arange(len(rows))-np.repeat(np.cumsum(block)-block,block)
+            closing=dst[first]*n+v[start:stop][rows]
+            if positions is not None:
+                second=positions[closing]
+                hit=second>=0
+            else:
+                second=np.minimum(np.searchsorted(keys,closing),len(keys)-1)
+                hit=keys[second]==closing
+            yield start,stop,rows[hit],first[hit],second[hit]
+            start=stop
+
+    #Training rows of the weighted classifier, one per key (node1,node2) with a nonzero weight: the weighted
+    #pair_partial_triads of the paths node2 -> neigh -> node1, labelled with whether the key's weight is positive,
+    #so that like the unweighted triads the partial triad predicts the edge closing it. Returns (attrs,labels,weights)
+    #as get_unweighted_attrs_and_labels, every row with weight 1
+    def get_weighted_attrs_and_labels(self):
+        src,dst,weights=self._directed_arrays()
+        keep=weights!=0
+        attrs=self.pair_partial_triads_ids(dst[keep],src[keep],weighted=True)
+        return (attrs,1.0*(weights[keep]>0),np.ones(np.count_nonzero(keep)))
+
+    #returns a length k tuple of (folds, test positions) where fold i is a FoldView without the edges at test positions i,
+    #positions into edge_arrays. FoldView.test_edges gives them as [((node1,node2),edge_weight)...]
     def k_folds(self,k):
-        out_test_edges=[]
+        order=self.shuffled_order()
+        folds=[self.fold(order,i,k) for i in range(k)]
+        return (folds,[fold.test for fold in folds])
+
+    #Returns a shuffled list of ((node1,node2),edge_weight) for splitting into folds
+    def shuffled_edges(self):
         edges=[]
         for edge in self.edge_dict:
             edges.append((edge,self.edge_dict[edge]))
         random.shuffle(edges)
-        graphs=[]
-        interval=len(edges)/float(k)
-        for i in range(k):
-            new_dict={}
-            test_edges=edges[int(i*interval):int((i+1)*interval)]
-            train_edges=edges[:int(i*interval)]
-            train_edges.extend(edges[int((i+1)*interval):])
-            for edge in train_edges:
-                new_dict[edge[0]]=edge[1]
-            graphs.append(Graph(self.nodes, new_dict))
-            out_test_edges.append(test_edges)
-        return (graphs,out_test_edges)
-
-def build_graph(data_folder):
-    (nodes,edge_dict)=process_mlb.read_folder(data_folder)
+        return edges
+
+    #Returns a shuffled array of the positions of the graph's edges, the permutation shuffled_edges applies
+    def shuffled_order(self):
+        order=range(len(self.edge_dict))
+        random.shuffle(order)
+        return np.array(order,dtype=np.int64)
+
+    #Returns the FoldView for fold i out of k of the shuffled positions, as in k_folds
+    def fold(self,order,i,k):
+        interval=len(order)/float(k)
+        return FoldView(self,order[int(i*interval):int((i+1)*interval)])
+
+class _MaskedEdges(Mapping):
+    #edge_dict of a fold: the shared edge_dict without the keys whose position is masked out
+    def __init__(self,graph,mask):
+        self.graph=graph
+        self.mask=mask
+
+    def __contains__(self,edge):
+        position=self.graph.edge_arrays()[4].get(edge)
+        return position is not None and self.mask[position]
+
+    def __getitem__(self,edge):
+        if edge not in self:
+            raise KeyError(edge)
+        return self.graph.edge_dict[edge]
+
+    def __iter__(self):
+        keys=self.graph.edge_arrays()[0]
+        for position in np.flatnonzero(self.mask):
+            yield keys[position]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+class _MaskedNeighbors(Mapping):
+    #edge_list of a fold: each node's shared neighbor list without the entries of masked out keys
+    def __init__(self,graph,mask):
+        self.graph=graph
+        self.mask=mask
+
+    def __getitem__(self,node):
+        indptr,neighbors,positions=self.graph.incidence()
+        i=self.graph.edge_arrays()[5][node]
+        entries=slice(indptr[i],indptr[i+1])
+        return [self.graph.nodes[j] for j in neighbors[entries][self.mask[positions[entries]]]]
+
+    def __iter__(self):
+        return iter(self.graph.nodes)
+
+    def __len__(self):
+        return len(self.graph.nodes)
+
+class FoldView(Graph):
+    """
+    A training fold of a Graph: the graph without its test edges. Instead of copying edge_dict and edge_list, it keeps
+    a boolean mask over the positions of the graph's shared edge arrays (see Graph.edge_arrays), and its edge_dict and
+    edge_list are views that skip masked out edges, so every Graph triad query works on it unchanged.
+    """
+
+    def __init__(self,graph,test):
+        #A fold of a fold masks the same shared arrays, test then holds positions among the fold's edges
+        if isinstance(graph,FoldView):
+            test=np.flatnonzero(graph.mask)[test]
+            mask=graph.mask.copy()
+            graph=graph.graph
+        else:
+            mask=np.ones(len(graph.edge_dict),dtype=bool)
+        mask[test]=False
+        self.graph=graph
+        self.test=test
+        self.mask=mask
+        self.nodes=graph.nodes
+        self.edge_dict=_MaskedEdges(graph,mask)
+        self.edge_list=_MaskedNeighbors(graph,mask)
+        self._triads=None
+        self._keys=None
+
+    def edge_arrays(self):
+        return self.graph.edge_arrays()
+
+    def incidence(self):
+        return self.graph.incidence()
+
+    def _directed_arrays(self):
+        keys,src,dst,weights,positions,index=self.graph.edge_arrays()
+        keep=self.mask&(src!=dst)
+        return src[keep],dst[keep],weights[keep]
+
+    #The held out edges as id arrays (src, dst, weights)
+    def test_arrays(self):
+        keys,src,dst,weights,positions,index=self.graph.edge_arrays()
+        return src[self.test],dst[self.test],weights[self.test]
+
+    #The held out edges as [((node1,node2),edge_weight)...], the form Graph.fold used to return
+    def test_edges(self):
+        keys=self.graph.edge_arrays()[0]
+        return [(keys[position],self.graph.edge_dict[keys[position]]) for position in self.test.tolist()]
+
+@instrument.timed('graph.build_mlb')
+def build_graph(data_folder,workers=1):
+    (nodes,edge_dict)=process_mlb.read_folder(data_folder,workers)
     return Graph(nodes,edge_dict)
 
         
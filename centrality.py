@@ -0,0 +1,126 @@
+import numpy as np
+import scipy.sparse as sp
+from csr_graph import intern
+import instrument
+
+#Sparse n x n matrix with weights[i] added at (src[i],dst[i]), repeated edges are summed
+def adjacency_matrix(num_nodes,src,dst,weights=None):
+    if weights is None:
+        weights=np.ones(len(src))
+    return sp.csr_matrix((np.asarray(weights,dtype=np.float64),(np.asarray(src,dtype=np.int64),np.asarray(dst,dtype=np.int64))),shape=(num_nodes,num_nodes))
+
+def _normalized(vector):
+    total=np.sqrt(np.dot(vector,vector))
+    if total>0:
+        return vector/total
+    return vector
+
+@instrument.timed('centrality.hits')
+def hits(num_nodes,src,dst,weights=None,tol=1e-8,max_iter=100,hubs=None,authorities=None,matrix=None):
+    """
+    Computes hub and authority scores of a weighted directed graph by power iteration
+
+    Args:
+        num_nodes (int): the number of nodes, ids run from 0 to num_nodes-1
+        src (array): the source id of every edge
+        dst (array): the destination id of every edge
+        weights (array): the weight of every edge, 1 for all edges if None
+        tol (float): stop once neither score vector moves more than this (L1 distance)
+        max_iter (int): the maximum number of iterations
+        hubs (array): starting hub scores, for warm starts
+        authorities (array): starting authority scores, for warm starts
+        matrix (scipy.sparse matrix): the adjacency matrix, when already built (src, dst and weights are then ignored)
+
+    Returns:
+        (hubs, authorities, iterations) where hubs[i] and authorities[i] are the unit length
+        scores of node i, and iterations is the number of iterations run
+    """
+    if matrix is None:
+        matrix=adjacency_matrix(num_nodes,src,dst,weights)
+    transpose=matrix.T.tocsr()
+    hubs=_normalized(np.ones(num_nodes) if hubs is None else np.asarray(hubs,dtype=np.float64))
+    authorities=_normalized(np.ones(num_nodes) if authorities is None else np.asarray(authorities,dtype=np.float64))
+    iterations=0
+    while iterations<max_iter:
+        iterations+=1
+        new_authorities=_normalized(transpose.dot(hubs))
+        new_hubs=_normalized(matrix.dot(new_authorities))
+        delta=max(np.abs(new_authorities-authorities).sum(),np.abs(new_hubs-hubs).sum())
+        hubs=new_hubs
+        authorities=new_authorities
+        if delta<tol:
+            break
+    instrument.observe('hits.iterations',iterations)
+    return hubs,authorities,iterations
+
+def hits_by_name(sources,targets,weights=None,names=None,**kwargs):
+    """
+    Runs hits on edges given by node names
+
+    Args:
+        sources (list): the source name of every edge
+        targets (list): the target name of every edge
+        weights (list): the weight of every edge, or None
+        names (list): all node names, which fixes the output order and includes nodes without edges.
+            Defaults to the sorted names appearing in the edges
+        kwargs: passed on to hits
+
+    Returns:
+        (names, hubs, authorities, iterations) with the scores of names[i] at index i
+    """
+    if names is None:
+        ids,names=intern(list(sources)+list(targets))
+    else:
+        index=dict((name,i) for i,name in enumerate(names))
+        ids=np.array([index[name] for name in list(sources)+list(targets)],dtype=np.int64)
+    num_edges=len(ids)//2
+    hubs,authorities,iterations=hits(len(names),ids[:num_edges],ids[num_edges:],weights,**kwargs)
+    return names,hubs,authorities,iterations
+
+@instrument.timed('centrality.pagerank')
+def pagerank(num_nodes,src,dst,weights=None,beta=0.85,tol=1e-10,max_iter=1000,personalization=None,start=None,matrix=None):
+    """
+    Computes PageRank by sparse power iteration. A walker at node i follows an out edge with
+    probability beta, picked in proportion to the edge weights, and teleports otherwise. Walkers at
+    nodes without out edges (dangling nodes) always teleport.
+
+    Args:
+        num_nodes (int): the number of nodes, ids run from 0 to num_nodes-1
+        src (array): the source id of every edge
+        dst (array): the destination id of every edge
+        weights (array): the weight of every edge, 1 for all edges if None
+        beta (float): 1 minus the teleport probability
+        tol (float): stop once the L1 change between iterations is below this
+        max_iter (int): the maximum number of iterations
+        personalization (array): the teleport distribution, uniform if None
+        start (array): the starting scores, for warm starts
+        matrix (scipy.sparse matrix): the adjacency matrix, when already built (src, dst and weights are then ignored)
+
+    Returns:
+        (ranks, iterations) where ranks sums to 1 and ranks[i] is the PageRank of node i
+    """
+    if matrix is None:
+        matrix=adjacency_matrix(num_nodes,src,dst,weights)
+    out_weight=np.asarray(matrix.sum(axis=1)).ravel()
+    dangling=out_weight==0
+    scale=np.where(dangling,0.0,1.0/np.where(dangling,1.0,out_weight))
+    #Column stochastic transpose of the transition matrix, so one step is a single sparse product
+    transition=sp.diags(scale).dot(matrix).T.tocsr()
+    if personalization is None:
+        teleport=np.ones(num_nodes)/num_nodes
+    else:
+        teleport=np.asarray(personalization,dtype=np.float64)
+        teleport=teleport/teleport.sum()
+    ranks=teleport.copy() if start is None else np.asarray(start,dtype=np.float64)/np.sum(start)
+    iterations=0
+    while iterations<max_iter:
+        iterations+=1
+        new_ranks=beta*transition.dot(ranks)
+        #Mass that did not follow an edge, from teleporting or dangling nodes, is spread by the teleport vector
+        new_ranks+=(1.0-new_ranks.sum())*teleport
+        residual=np.abs(new_ranks-ranks).sum()
+        ranks=new_ranks
+        if residual<tol:
+            break
+    instrument.observe('pagerank.iterations',iterations)
+    return ranks,iterations
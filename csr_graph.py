@@ -0,0 +1,286 @@
+import numpy as np
+import instrument
+import sampling
+import scipy.sparse as sp
+from collections import defaultdict
+
+#Maps a sequence of hashable labels to dense integer ids.
+#Returns (ids, names) where ids is an int array with names[ids[i]]==labels[i], names are sorted
+def intern(labels):
+    names,ids=np.unique(np.asarray(labels),return_inverse=True)
+    return ids.astype(np.int64),names.tolist()
+
+#Builds a symmetric CSR structure over n nodes from the pairs (src[i],dst[i]).
+#Every pair is stored in both directions, rows and the neighbors within a row are sorted.
+#Returns (indptr, indices, order) where order maps each CSR position back to its position in
+#the concatenated array [src,dst], so per-edge data can be permuted with data[order].
+def csr_from_pairs(n,src,dst,tiebreak=None):
+    rows=np.concatenate((src,dst))
+    cols=np.concatenate((dst,src))
+    if tiebreak is None:
+        order=np.lexsort((cols,rows))
+    else:
+        order=np.lexsort((np.concatenate((tiebreak,tiebreak)),cols,rows))
+    indptr=np.zeros(n+1,dtype=np.int64)
+    np.cumsum(np.bincount(rows,minlength=n),out=indptr[1:])
+    return indptr,cols[order],order
+
+class CSRGraph(object):
+    """
+    Compact adjacency for a win/loss graph. Team names are mapped to dense ids once, and the
+    graph is stored as CSR arrays with one slot per distinct neighbor:
+
+        indptr, indices: row u holds the sorted neighbors of u in indices[indptr[u]:indptr[u+1]]
+        mult: the number of games between u and the neighbor (the multiplicity the dict backend
+            keeps as repeated entries in its neighbor lists)
+        sign: True means u beat the neighbor, mirroring Graph.edge_weights[(u,neighbor)]
+
+    Since rows and neighbors are sorted, membership checks are binary searches and common
+    neighbors are sorted set intersections.
+    """
+
+    def __init__(self,names,indptr,indices,mult,sign):
+        self.names=names
+        self.ids=dict((name,i) for i,name in enumerate(names))
+        self.indptr=indptr
+        self.indices=indices
+        self.mult=mult
+        self.sign=sign
+        self._keys=None
+        self._pattern=None
+
+    #Edge list is a list of edges from winners to losers, as for Graph.Graph. When a pair played
+    #several times the sign of the last game wins, just like the overwrite in Graph.__init__
+    @classmethod
+    def from_edge_list(cls,edge_list):
+        edge_list=list(edge_list)
+        if len(edge_list)==0:
+            return cls._from_pairs([],np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64))
+        ids,names=intern([node for edge in edge_list for node in edge])
+        return cls._from_pairs(names,ids[0::2],ids[1::2])
+
+    #Same as from_edge_list for games given as winner/loser ids into names (e.g. from a gametable.GameTable).
+    #Nodes without games are dropped and the rest renumbered in sorted name order, as from_edge_list does
+    @classmethod
+    def from_ids(cls,names,winner,loser):
+        used=np.unique(np.concatenate((winner,loser)))
+        used=np.array(sorted(used.tolist(),key=lambda i:names[i]),dtype=np.int64)
+        remap=np.zeros(len(names),dtype=np.int64)
+        remap[used]=np.arange(len(used))
+        return cls._from_pairs([names[i] for i in used],remap[winner],remap[loser])
+
+    @classmethod
+    def _from_pairs(cls,names,src,dst):
+        if len(src)==0:
+            return cls([],np.zeros(1,dtype=np.int64),np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64),np.zeros(0,dtype=bool))
+        m=len(src)
+        indptr,indices,order=csr_from_pairs(len(names),src,dst,tiebreak=np.arange(m))
+        rows=np.repeat(np.arange(len(names)),np.diff(indptr))
+        sign=(order<m)
+        #Collapse repeated (row, neighbor) slots, keeping the count and the last sign
+        last=np.ones(len(indices),dtype=bool)
+        last[:-1]=(rows[1:]!=rows[:-1])|(indices[1:]!=indices[:-1])
+        ends=np.flatnonzero(last)
+        mult=np.diff(np.concatenate(([-1],ends)))
+        counts=np.bincount(rows[ends],minlength=len(names))
+        new_indptr=np.zeros(len(names)+1,dtype=np.int64)
+        np.cumsum(counts,out=new_indptr[1:])
+        return cls(names,new_indptr,indices[ends],mult.astype(np.int64),sign[ends])
+
+    #Builds the compact form of the dict backend's edge_list/edge_weights pair
+    @classmethod
+    def from_dicts(cls,edge_list,edge_weights):
+        names=sorted(edge_list.keys())
+        ids=dict((name,i) for i,name in enumerate(names))
+        indptr=np.zeros(len(names)+1,dtype=np.int64)
+        indices=[]
+        mult=[]
+        sign=[]
+        for i,node in enumerate(names):
+            counts=defaultdict(int)
+            for neigh in edge_list[node]:
+                counts[neigh]+=1
+            row=sorted((ids[neigh],neigh) for neigh in counts)
+            for j,neigh in row:
+                indices.append(j)
+                mult.append(counts[neigh])
+                sign.append(edge_weights[(node,neigh)])
+            indptr[i+1]=len(indices)
+        return cls(names,indptr,np.array(indices,dtype=np.int64),np.array(mult,dtype=np.int64),np.array(sign,dtype=bool))
+
+    def num_nodes(self):
+        return len(self.names)
+
+    def num_slots(self):
+        return len(self.indices)
+
+    def neighbors(self,node_id):
+        return self.indices[self.indptr[node_id]:self.indptr[node_id+1]]
+
+    #Row index of every CSR slot
+    def rows(self):
+        return np.repeat(np.arange(self.num_nodes()),np.diff(self.indptr))
+
+    #Position of the slot (u,v) in the CSR arrays, or -1 if u and v never played.
+    #Works on scalars or arrays of ids.
+    def slot(self,u,v):
+        if self._keys is None:
+            self._keys=self.rows()*self.num_nodes()+self.indices
+        key=np.asarray(u,dtype=np.int64)*self.num_nodes()+np.asarray(v,dtype=np.int64)
+        if len(self._keys)==0:
+            return np.full(np.shape(key),-1,dtype=np.int64)
+        pos=np.minimum(np.searchsorted(self._keys,key),len(self._keys)-1)
+        return np.where(self._keys[pos]==key,pos,-1)
+
+    def has_edge(self,node1,node2):
+        return self.slot(self.ids[node1],self.ids[node2])>=0
+
+    #Common neighbors w of u and v, returned as the CSR positions of (u,w) and (v,w)
+    def _common(self,u,v):
+        start_u=self.indptr[u]
+        start_v=self.indptr[v]
+        common,pos_u,pos_v=np.intersect1d(self.neighbors(u),self.neighbors(v),assume_unique=True,return_indices=True)
+        return pos_u+start_u,pos_v+start_v
+
+    #Same as Graph.get_partial_triads, counts of (node1->w, w->node2) signs over common neighbors w
+    def get_partial_triads(self,node1,node2):
+        pos_u,pos_v=self._common(self.ids[node1],self.ids[node2])
+        #sign(w,node2) is the opposite of sign(node2,w)
+        codes=2*self.sign[pos_u]+(~self.sign[pos_v])
+        counts=np.bincount(codes,weights=self.mult[pos_u],minlength=4)
+        return {(False,False):int(counts[0]),(False,True):int(counts[1]),(True,False):int(counts[2]),(True,True):int(counts[3])}
+
+    #Same as Graph.get_triads, triads node1 -> w -> node2 -> node1 mapped to counts
+    def get_triads(self,node1,node2):
+        triads=defaultdict(int)
+        u=self.ids[node1]
+        v=self.ids[node2]
+        pos=self.slot(v,u)
+        if pos<0:
+            return triads
+        closing=bool(self.sign[pos])
+        pos_u,pos_v=self._common(u,v)
+        for s1,s2,m in zip(self.sign[pos_u],~self.sign[pos_v],self.mult[pos_u]):
+            triads[(bool(s1),bool(s2),closing)]+=int(m)
+        return triads
+
+    #Sparse n x n matrix of the slots whose sign equals won, holding the game counts (counts=True)
+    #or ones (counts=False)
+    def signed_matrix(self,won,counts=True):
+        data=np.where(self.sign==won,self.mult if counts else 1,0).astype(np.float64)
+        out=sp.csr_matrix((data,self.indices,self.indptr),shape=(self.num_nodes(),self.num_nodes()))
+        out.eliminate_zeros()
+        return out
+
+    #Sparse n x n matrix with a one in every slot
+    def pattern(self):
+        if self._pattern is None:
+            self._pattern=sp.csr_matrix((np.ones(self.num_slots()),self.indices,self.indptr),shape=(self.num_nodes(),self.num_nodes()))
+        return self._pattern
+
+    #Values of the product left*right read off at every CSR slot. The product is formed a block of
+    #rows at a time, each block covering about chunk slots, so it is never held in full
+    def slot_products(self,left,right,chunk=1<<18):
+        out=np.zeros(self.num_slots())
+        n=self.num_nodes()
+        start=0
+        while start<n:
+            stop=int(np.searchsorted(self.indptr,self.indptr[start]+chunk,side='right'))-1
+            stop=min(max(stop,start+1),n)
+            lo=self.indptr[start]
+            hi=self.indptr[stop]
+            if hi>lo:
+                #Masking the product with the slot pattern keeps only the entries we read off
+                block=self.pattern()[start:stop].multiply(left[start:stop]*right).tocsr()
+                block.sort_indices()
+                #Both the block entries and the slots are sorted by (row, column), so look the
+                #slots up among the block entries with a binary search
+                block_keys=np.repeat(np.arange(stop-start,dtype=np.int64),np.diff(block.indptr))*n+block.indices
+                slot_keys=np.repeat(np.arange(stop-start,dtype=np.int64),np.diff(self.indptr[start:stop+1]))*n+self.indices[lo:hi]
+                if len(block_keys)>0:
+                    pos=np.minimum(np.searchsorted(block_keys,slot_keys),len(block_keys)-1)
+                    out[lo:hi]=np.where(block_keys[pos]==slot_keys,block.data[pos],0)
+            start=stop
+        return out
+
+    #Partial triad counts for every slot (u,v) at once, one column per (u->w, w->v) sign pair in
+    #sorted key order: (False,False), (False,True), (True,False), (True,True).
+    #Column (s1,s2) is the product of the s1 game-count matrix with the s2 indicator matrix at (u,v)
+    @instrument.timed('triads.partial')
+    def slot_partial_triads(self):
+        counts={True:self.signed_matrix(True),False:self.signed_matrix(False)}
+        indicators={True:self.signed_matrix(True,counts=False),False:self.signed_matrix(False,counts=False)}
+        out=np.zeros((self.num_slots(),4))
+        for col,(s1,s2) in enumerate([(False,False),(False,True),(True,False),(True,True)]):
+            out[:,col]=self.slot_products(counts[s1],indicators[s2])
+        return out
+
+    #Partial triad counts for arbitrary pairs of ids (u[i],v[i]) at once, columns as in slot_partial_triads.
+    #Row i is the dot product of row u[i] of a game-count matrix with column v[i] of an indicator matrix;
+    #an id of -1 (a node not in the graph) gives a row of zeros. Pairs are handled chunk at a time.
+    def pair_partial_triads(self,u,v,chunk=1<<14):
+        u=np.asarray(u,dtype=np.int64)
+        v=np.asarray(v,dtype=np.int64)
+        out=np.zeros((len(u),4))
+        known=np.flatnonzero((u>=0)&(v>=0))
+        counts={True:self.signed_matrix(True),False:self.signed_matrix(False)}
+        #Column v of the s2 indicator matrix is row v of the (not s2) one, since sign(w,v) is not sign(v,w)
+        columns={True:self.signed_matrix(False,counts=False),False:self.signed_matrix(True,counts=False)}
+        for start in range(0,len(known),chunk):
+            rows=known[start:start+chunk]
+            for col,(s1,s2) in enumerate([(False,False),(False,True),(True,False),(True,True)]):
+                out[rows,col]=np.asarray(counts[s1][u[rows]].multiply(columns[s2][v[rows]]).sum(axis=1)).ravel()
+        return out
+
+    #Estimates triad_census from a random sample of the slots, each counting the triads it closes in all its games,
+    #so only the sampled slots' common neighbors are visited. samples caps the slots drawn and rel_error stops once
+    #every type is known to that relative error, see sampling.estimate_totals. Returns (triads, intervals, drawn)
+    #where triads maps each type seen to its estimated count and intervals to its (low, high) confidence bounds
+    def estimate_triad_census(self,samples=None,rel_error=None,confidence=0.95,seed=None):
+        rows=self.rows()
+        def values(sample):
+            partial=self.pair_partial_triads(rows[sample],self.indices[sample])*self.mult[sample][:,None]
+            out=np.zeros((len(sample),8))
+            closing=(~self.sign[sample]).astype(np.int64)
+            for col in range(4):
+                out[np.arange(len(sample)),2*col+closing]=partial[:,col]
+            return out
+        estimate,lower,upper,drawn=sampling.estimate_totals(self.num_slots(),values,samples,rel_error,confidence,seed)
+        triads=defaultdict(int)
+        intervals={}
+        for code in range(8):
+            if estimate[code]>0:
+                triads[(code>=4,code%4>=2,code%2==1)]=estimate[code]
+                intervals[(code>=4,code%4>=2,code%2==1)]=(lower[code],upper[code])
+        return triads,intervals,drawn
+
+    #Ids of a sequence of names, -1 for names not in the graph
+    def lookup(self,names):
+        return np.array([self.ids.get(name,-1) for name in names],dtype=np.int64)
+
+    #Whole graph census of the 8 signed triad types, matching Graph.get_all_triads: every game (u,v),
+    #in each direction, contributes its partial triads u -> w -> v, closed by the sign of v -> u.
+    #Returns the (bool,bool,bool) -> count mapping. With per_node or per_edge it returns
+    #(triads, node_counts, edge_counts) instead, where node_counts is num_nodes x 8 (triads starting at
+    #each node) and edge_counts is num_slots x 8 (triads closed by each slot, all its games included),
+    #columns in sorted key order, and whichever array was not asked for is None
+    @instrument.timed('triads.census')
+    def triad_census(self,per_node=False,per_edge=False):
+        partial=self.slot_partial_triads()*self.mult[:,None]
+        edge_counts=np.zeros((self.num_slots(),8))
+        #Column 4*s1+2*s2+s3 is key (s1,s2,s3), the closing sign s3 is the opposite of the slot's sign
+        closing=(~self.sign).astype(np.int64)
+        for col in range(4):
+            edge_counts[np.arange(self.num_slots()),2*col+closing]=partial[:,col]
+        totals=edge_counts.sum(axis=0)
+        triads=defaultdict(int)
+        for code in range(8):
+            if totals[code]>0:
+                triads[(code>=4,code%4>=2,code%2==1)]=int(round(totals[code]))
+        if not per_node and not per_edge:
+            return triads
+        node_counts=None
+        if per_node:
+            node_counts=np.zeros((self.num_nodes(),8))
+            np.add.at(node_counts,self.rows(),edge_counts)
+        return triads,node_counts,(edge_counts if per_edge else None)
@@ -1,5 +1,10 @@
+import os
+import sys
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from gametable import GameTable
+
 teams = {'Royal Challengers Bangalore': 1,
 			'Mumbai Indians': 2,
 			'Kolkata Knight Riders': 3,
@@ -43,6 +48,37 @@ def data():
 
 	return A
 
+def table():
+	"""
+	Expands the head to head records into a gametable.GameTable with one row per decided
+	match (ties decided by a super over count for their winner). Seasons, dates and scores
+	are not in the records and stay missing. Every pair is listed under both teams, so a
+	record is only used from the team whose name sorts first, unless the opponent has no
+	section of its own.
+	"""
+	records = []
+	sections = set()
+	curr = None
+	for line in open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ipl.csv')):
+		line = line.strip()
+		if line == '':
+			continue
+		if 'IPL' in line:
+			curr = line[:line.find('IPL')-1]
+			sections.add(curr)
+		elif 'Opponent' not in line:
+			elements = line.split(',')
+			won, lost, tieWon, tieLost = [int(a) for a in (elements[2], elements[3], elements[4], elements[5])]
+			records.append((curr, elements[0][2:], won + tieWon, lost + tieLost))
+
+	pairs = []
+	for team, opp, wins, losses in records:
+		if opp in sections and opp < team:
+			continue
+		pairs.extend([(team, opp)] * wins)
+		pairs.extend([(opp, team)] * losses)
+	return GameTable.from_pairs(pairs, sorted(teams, key=teams.get))
+
 
 if __name__ == '__main__':
 	print data()
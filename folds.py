@@ -0,0 +1,42 @@
+import multiprocessing
+import instrument
+
+def run_folds(fn,init,state,k,workers=1):
+    """
+    Evaluates fn(i) for every fold i in range(k), serially or in a process pool
+
+    Args:
+        fn (int -> result): a module level function evaluating one fold
+        init (state -> None): a module level function storing state where fn can read it
+        state (tuple): everything the folds share, e.g. the shuffled edges
+        k (int): the number of folds
+        workers (int): the number of worker processes, 1 runs in this process
+
+    Returns:
+        A list of the k results in fold order. The state is handed to each worker once
+        when it starts, instead of being pickled along with every task. When instrument is
+        enabled, what the workers record is merged into this process.
+    """
+    if workers<=1:
+        init(state)
+        return [fn(i) for i in range(k)]
+    pool=multiprocessing.Pool(min(workers,k),init,(state,))
+    try:
+        if not instrument.enabled():
+            return pool.map(fn,range(k))
+        results=[]
+        for result,state in pool.map(_instrumented,[(fn,i) for i in range(k)]):
+            instrument.merge(state)
+            results.append(result)
+        return results
+    finally:
+        pool.close()
+        pool.join()
+
+#Runs one fold in a worker with instrumentation on, returning what it recorded along with the result
+def _instrumented(task):
+    fn,i=task
+    instrument.reset()
+    instrument.enable()
+    result=fn(i)
+    return result,instrument.snapshot()
@@ -0,0 +1,134 @@
+import numpy as np
+
+#One row per game. winner and loser are ids into GameTable.teams; for ties (tie=True) they are just the two
+#sides, as the source lists them. Scores and margins the source does not have are MISSING
+GAME_DTYPE=np.dtype([('season',np.int16),('date','datetime64[D]'),('winner',np.int32),('loser',np.int32),
+                     ('winner_score',np.int16),('loser_score',np.int16),('margin',np.int16),('tie',np.bool_)])
+MISSING=-1
+
+class GameTable(object):
+    """
+    Columnar table of games shared by the MLB, NFL and IPL loaders. Team names are interned once into
+    teams and every game is a row of a GAME_DTYPE structured array, so consumers work on integer ids
+    and can build their edge dicts or arrays from whole columns.
+    """
+
+    def __init__(self,teams,games):
+        self.teams=list(teams)
+        self.ids=dict((team,i) for i,team in enumerate(self.teams))
+        self.games=games
+
+    #Builds a table from id columns into teams. Every other column may be a scalar or an array, and
+    #defaults to MISSING (NaT for dates, False for ties). Margins are computed from the scores
+    @classmethod
+    def from_columns(cls,teams,winner,loser,season=MISSING,date=None,winner_score=None,loser_score=None,tie=None):
+        games=np.zeros(len(winner),dtype=GAME_DTYPE)
+        games['winner']=winner
+        games['loser']=loser
+        games['season']=season
+        games['date']=np.datetime64('NaT') if date is None else date
+        games['winner_score']=MISSING if winner_score is None else winner_score
+        games['loser_score']=MISSING if loser_score is None else loser_score
+        if tie is not None:
+            games['tie']=tie
+        scored=(games['winner_score']!=MISSING)&(games['loser_score']!=MISSING)
+        games['margin']=np.where(scored,games['winner_score']-games['loser_score'],MISSING)
+        return cls(teams,games)
+
+    #Builds a table from (winner, loser) name pairs, teams are the sorted names unless given
+    @classmethod
+    def from_pairs(cls,pairs,teams=None,**columns):
+        pairs=list(pairs)
+        if teams is None:
+            teams=sorted(set(name for pair in pairs for name in pair))
+        ids=dict((team,i) for i,team in enumerate(teams))
+        winner=np.array([ids[pair[0]] for pair in pairs],dtype=np.int32)
+        loser=np.array([ids[pair[1]] for pair in pairs],dtype=np.int32)
+        return cls.from_columns(teams,winner,loser,**columns)
+
+    #Stacks tables, e.g. several seasons. Teams keep the order of their first appearance
+    @classmethod
+    def concat(cls,tables):
+        teams=[]
+        ids={}
+        parts=[]
+        for table in tables:
+            for team in table.teams:
+                if team not in ids:
+                    ids[team]=len(teams)
+                    teams.append(team)
+            remap=np.array([ids[team] for team in table.teams]+[0],dtype=np.int32)
+            games=table.games.copy()
+            games['winner']=remap[games['winner']]
+            games['loser']=remap[games['loser']]
+            parts.append(games)
+        if not parts:
+            return cls([],np.zeros(0,dtype=GAME_DTYPE))
+        return cls(teams,np.concatenate(parts))
+
+    def __len__(self):
+        return len(self.games)
+
+    #Ids of names, -1 for teams not in the table
+    def team_ids(self,names):
+        return np.array([self.ids.get(name,-1) for name in names],dtype=np.int64)
+
+    #A table with the games where mask is True and the same teams
+    def select(self,mask):
+        return GameTable(self.teams,self.games[mask])
+
+    #A table with the games between two of the given teams, e.g. to drop teams outside the league
+    def between(self,names):
+        member=np.zeros(len(self.teams)+1,dtype=bool)
+        member[self.team_ids(names)]=True
+        member[-1]=False
+        return self.select(member[self.games['winner']]&member[self.games['loser']])
+
+    #The (winner, loser) name pairs of all games, in table order
+    def pairs(self):
+        names=np.array(self.teams,dtype=object)
+        return list(zip(names[self.games['winner']].tolist(),names[self.games['loser']].tolist()))
+
+    #Id of the ordered pair (u, v), for bincount and unique over pairs
+    def _pair_keys(self,u,v):
+        return u.astype(np.int64)*len(self.teams)+v
+
+    #Discounted win/loss spreads of every ordered pair that played, as in sportsdata.getMLBEdges: each game adds
+    #gamma**(end - season) to (winner, loser) and subtracts it from (loser, winner). Ties are skipped.
+    #end defaults to the last season. Returns (src, dst, spreads) sorted by pair
+    def spread_arrays(self,gamma=1.0,end=None):
+        games=self.games[~self.games['tie']]
+        if end is None:
+            end=games['season'].max() if len(games) else 0
+        discount=np.power(float(gamma),(end-games['season']).astype(np.float64))
+        n=len(self.teams)
+        keys=np.concatenate((self._pair_keys(games['winner'],games['loser']),self._pair_keys(games['loser'],games['winner'])))
+        unique,inverse=np.unique(keys,return_inverse=True)
+        spreads=np.bincount(inverse,weights=np.concatenate((discount,-discount)),minlength=len(unique))
+        return unique//max(n,1),unique%max(n,1),spreads
+
+    #spread_arrays as a dictionary of (team1, team2) -> spread
+    def spread_dict(self,gamma=1.0,end=None):
+        src,dst,spreads=self.spread_arrays(gamma,end)
+        names=np.array(self.teams,dtype=object)
+        return dict(zip(zip(names[src].tolist(),names[dst].tolist()),spreads.tolist()))
+
+    #Ids of the games won by the team that won the majority of its games against the loser, in table order.
+    #Ties and games of pairs that split evenly are dropped, as Graph.mlb_edge_list always did
+    def majority_ids(self):
+        games=self.games[~self.games['tie']]
+        if len(games)==0:
+            return games['winner'],games['loser']
+        keys=self._pair_keys(games['winner'],games['loser'])
+        unique,inverse,counts=np.unique(keys,return_inverse=True,return_counts=True)
+        reverse=self._pair_keys(games['loser'],games['winner'])
+        position=np.minimum(np.searchsorted(unique,reverse),len(unique)-1)
+        reverse_counts=np.where(unique[position]==reverse,counts[position],0)
+        keep=counts[inverse]>reverse_counts
+        return games['winner'][keep],games['loser'][keep]
+
+    #majority_ids as a list of (winner, loser) names, the edge list Graph.Graph takes
+    def edge_list(self):
+        winner,loser=self.majority_ids()
+        names=np.array(self.teams,dtype=object)
+        return list(zip(names[winner].tolist(),names[loser].tolist()))
@@ -1,28 +1,22 @@
 import mlbgame
 import nflgame
 import numpy as np
-from numpy.linalg import norm
-from numpy.linalg import eig
 import random
+import centrality
+import sportsdata
 
-#Returns a dictionary of the HITS score for each node.
-#HITS is generally supposed to work in a directed graph, so to modify it to work in an undirected setting I
-#am not using hubs, because hubs and authorities are essentially the same in the undirected setting. 
-#So I am just updating authorities, using authorities. Also, I am only utilizing edges where consorting appears.
-#So failed attempts do not influence the HITS score for a node.
-def HITS(nodes,edge_list,edge_weights):
-    authorities={}
-    hubs={}
-    for node in nodes:
-        authorities[node]=1.0
-    for i in range(100):
-        total_auth=0.0
-        for edge in edge_list:
-            authorities[edge[0]]+=authorities[edge[1]]
-            total_auth+=authorities[edge[1]]
-        for node in nodes:
-            authorities[node]/=(total_auth**.5)
-    return authorities
+#Returns a dictionary of the HITS authority score for each node, computed by centrality.hits.
+#edge_list is a list of (winner, loser) games, and every game is a directed edge from the loser to the winner,
+#weighted by edge_weights[(winner, loser)] when edge_weights is given. So a node gets authority by beating
+#good hubs, and hubs are the nodes that lost to strong nodes. Iteration stops once the scores stop moving
+#(see centrality.hits for tol, max_iter and warm start arguments).
+def HITS(nodes,edge_list,edge_weights=None,**kwargs):
+    weights=None
+    if edge_weights is not None:
+        weights=[edge_weights[edge] for edge in edge_list]
+    names,hubs,authorities,iterations=centrality.hits_by_name([edge[1] for edge in edge_list],[edge[0] for edge in edge_list],
+                                                              weights,names=list(nodes),**kwargs)
+    return dict(zip(names,authorities))
 
 #Regular pagerank, beta is 1 minus the teleport probability, so set it to 1 to never teleport
 #ids is a list of tuples where the first element is the first baboons id, second is the second baboons id
@@ -30,34 +24,25 @@ def HITS(nodes,edge_list,edge_weights):
 #Note that like HITS we only utilize the successful edges, but unlike in HITS we utilize the number of successes. E.g.
 #A successfully connecting with B twice means that it gets twice the amount of rank from B then if it did it once.
 #Also, note that like HITS we are treating this as undirected.
+#Ranks are computed by centrality.pagerank, a sparse power iteration that stops once the L1 residual is below tol.
+#Nodes without successful edges teleport, and personalization optionally maps nodes to teleport weights.
 #ids, attrs, labels 
-def PageRank(ids,labels,beta=.9):
+def PageRank(ids,labels,beta=.9,personalization=None,tol=1e-10,max_iter=1000):
     edge_list,edge_class=construct_edges(ids,labels)
-    #Constructing weighted adjacency matrix
-    M=np.zeros((len(edge_list),len(edge_list)))
-    indices={}
-    counter=0
+    nodes=list(edge_list.keys())
+    indices=dict((node,i) for i,node in enumerate(nodes))
+    src=[]
+    dst=[]
+    weights=[]
     for node in edge_list:
-        if node not in indices:
-            indices[node]=counter
-            counter+=1
-        num_edges=0
-        for neigh in edge_list[node]:
-            num_edges+=edge_class[(node,neigh)].count(1)
         for neigh in edge_list[node]:
-            if neigh not in indices:
-                indices[neigh]=counter
-                counter+=1
-            if num_edges>0:
-                M[indices[node],indices[neigh]]=edge_class[(node,neigh)].count(1)/float(num_edges)
-    M=beta*M+(1-beta)/float(M.size)
-    values,vectors=eig(M.T)
-    largest_index=0
-    for i in range(len(values)):
-        if values[i]>values[largest_index]:
-            largest_index=i
-    principle_vector=vectors[:,largest_index]
-    principle_vector/=sum(principle_vector)
+            src.append(indices[node])
+            dst.append(indices[neigh])
+            weights.append(edge_class[(node,neigh)].count(1))
+    teleport=None
+    if personalization is not None:
+        teleport=[personalization.get(node,0.0) for node in nodes]
+    principle_vector,iterations=centrality.pagerank(len(nodes),src,dst,weights,beta=beta,tol=tol,max_iter=max_iter,personalization=teleport)
     ranks={}
     for node in indices:
         ranks[node]=principle_vector[indices[node]]
@@ -75,11 +60,11 @@ def construct_edges(ids, labels):
             edge_list[entry[0]]=[]
         if entry[1] not in edge_list:
             edge_list[entry[1]]=[]
-        if entry[1] not in edge_list[entry[0]]:
-            edge_list[entry[0]].append(entry[1])
-        if entry[0] not in edge_list[entry[1]]:
-            edge_list[entry[1]].append(entry[0])
+        #A pair is new exactly when it has no edge_class entry yet, which saves scanning the neighbor lists
         if (entry[0],entry[1]) not in edge_class:
+            edge_list[entry[0]].append(entry[1])
+            if entry[0]!=entry[1]:
+                edge_list[entry[1]].append(entry[0])
             edge_class[(entry[0],entry[1])]=[]
             edge_class[(entry[1],entry[0])]=[]
         edge_class[(entry[0],entry[1])].append(entry[2])
@@ -87,6 +72,19 @@ def construct_edges(ids, labels):
     size=0
     return (edge_list,edge_class)
 
+#Returns (nodes, edge_list, edge_weights) for HITS and eval_acc from a gametable.GameTable: every game that is not a tie
+#is a (winner, loser) edge, and edge_weights maps each (winner, loser) pair to the largest margin between them
+def table_edges(table):
+    games=table.games[~table.games['tie']]
+    keys=games['winner'].astype(np.int64)*len(table.teams)+games['loser']
+    unique,inverse=np.unique(keys,return_inverse=True)
+    margins=np.zeros(len(unique),dtype=np.int64)
+    np.maximum.at(margins,inverse,np.abs(games['margin']))
+    names=np.array(table.teams,dtype=object)
+    edge_list=list(zip(names[games['winner']].tolist(),names[games['loser']].tolist()))
+    pairs=zip(names[unique//len(table.teams)].tolist(),names[unique%len(table.teams)].tolist())
+    return list(table.teams),edge_list,dict(zip(pairs,margins.tolist()))
+
 #Returns a length k list of 2 tuples where the first element of each tuple is a list of training examples
 #and the second is a list of test examples
 def k_folds(edge_list,k=5):
@@ -121,20 +119,8 @@ def eval_acc(nodes,edge_list,edge_weights):
 if __name__=='__main__':
     random.seed(10)
     teams = [ str(team[0]) for team in nflgame.teams ]
-    games=nflgame.games(2011)
-
-    #print games
     print teams
-    edge_list=[]
-    edge_weights={}
-    for game in games:
-        if str(game.winner) not in teams or str(game.loser) not in teams:
-            continue
-        if (str(game.winner),str(game.loser)) in edge_list:
-            edge_weights[(str(game.winner),str(game.loser))]=max(edge_weights[(str(game.winner),str(game.loser))],abs(game.score_home-game.score_away))
-        else:
-            edge_weights[(str(game.winner),str(game.loser))]=abs(game.score_home-game.score_away)
-        edge_list.append((str(game.winner),str(game.loser)))
+    edge_list,edge_weights=table_edges(sportsdata.getNFLTable(2011).between(teams))[1:]
     eval_acc(teams,edge_list,edge_weights)
     """
     teams = [ team.club.upper() for team in mlbgame.teams() ]
@@ -0,0 +1,165 @@
+"""
+Opt-in timing spans and counters for the pipeline stages.
+
+Instrumentation is off unless the INSTRUMENT environment variable is set to something other
+than 0 (or enable() is called). While off, span() hands back a shared do-nothing context
+manager and count()/observe() return at once, so instrumented code costs one global lookup
+and a call. With INSTRUMENT_OUTPUT set to a path, the report is written there as JSON when
+the process exits; INSTRUMENT=table prints the summary table to stderr instead.
+
+    with instrument.span('graph.fit'):
+        model.fit(attrs, labels)
+    instrument.observe('hits.iterations', iterations)
+"""
+import atexit
+import json
+import os
+import sys
+import time
+from functools import wraps
+
+_enabled=os.environ.get('INSTRUMENT','0') not in ('','0')
+_spans={}#name -> [count, total, min, max] of durations in seconds
+_values={}#name -> [count, total, min, max] of observed values
+_counters={}#name -> running total
+
+def enable():
+    global _enabled
+    _enabled=True
+
+def disable():
+    global _enabled
+    _enabled=False
+
+def enabled():
+    return _enabled
+
+def reset():
+    _spans.clear()
+    _values.clear()
+    _counters.clear()
+
+def _record(table,name,value):
+    stats=table.get(name)
+    if stats is None:
+        table[name]=[1,value,value,value]
+    else:
+        stats[0]+=1
+        stats[1]+=value
+        if value<stats[2]:
+            stats[2]=value
+        if value>stats[3]:
+            stats[3]=value
+
+class _Span(object):
+    __slots__=('name','start')
+
+    def __init__(self,name):
+        self.name=name
+
+    def __enter__(self):
+        self.start=time.time()
+        return self
+
+    def __exit__(self,*exc):
+        _record(_spans,self.name,time.time()-self.start)
+        return False
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+_NULL_SPAN=_NullSpan()
+
+#Context manager timing its block under name
+def span(name):
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+#Decorator timing every call of the function under name
+def timed(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args,**kwargs):
+            if not _enabled:
+                return fn(*args,**kwargs)
+            with _Span(name):
+                return fn(*args,**kwargs)
+        return wrapper
+    return decorate
+
+#Adds value to the counter name
+def count(name,value=1):
+    if _enabled:
+        _counters[name]=_counters.get(name,0)+value
+
+#Records one value of a distribution, e.g. the iterations a power iteration took to converge
+def observe(name,value):
+    if _enabled:
+        _record(_values,name,value)
+
+def _stats(table):
+    return dict((name,{'count':stats[0],'total':stats[1],'mean':stats[1]/float(stats[0]),'min':stats[2],'max':stats[3]})
+                for name,stats in table.items())
+
+#All spans (in seconds), observed values and counters recorded so far
+def report():
+    return {'spans':_stats(_spans),'values':_stats(_values),'counters':dict(_counters)}
+
+#The raw state, to send back from worker processes and merge into the parent with merge
+def snapshot():
+    return (dict((name,list(stats)) for name,stats in _spans.items()),
+            dict((name,list(stats)) for name,stats in _values.items()),dict(_counters))
+
+def merge(state):
+    spans,values,counters=state
+    for table,other in ((_spans,spans),(_values,values)):
+        for name,stats in other.items():
+            if name not in table:
+                table[name]=list(stats)
+            else:
+                mine=table[name]
+                mine[0]+=stats[0]
+                mine[1]+=stats[1]
+                mine[2]=min(mine[2],stats[2])
+                mine[3]=max(mine[3],stats[3])
+    for name,value in counters.items():
+        _counters[name]=_counters.get(name,0)+value
+
+def to_json(path=None):
+    text=json.dumps(report(),indent=2,sort_keys=True)
+    if path is not None:
+        with open(path,'w') as f:
+            f.write(text)
+    return text
+
+#The report as a fixed width table, spans sorted by total time
+def summary():
+    lines=['%-32s %8s %12s %12s %12s'%('span','count','total s','mean s','max s')]
+    for name,stats in sorted(_stats(_spans).items(),key=lambda item:-item[1]['total']):
+        lines.append('%-32s %8d %12.4f %12.6f %12.6f'%(name,stats['count'],stats['total'],stats['mean'],stats['max']))
+    if _values:
+        lines.append('')
+        lines.append('%-32s %8s %12s %12s %12s'%('value','count','mean','min','max'))
+        for name,stats in sorted(_stats(_values).items()):
+            lines.append('%-32s %8d %12.4f %12g %12g'%(name,stats['count'],stats['mean'],stats['min'],stats['max']))
+    if _counters:
+        lines.append('')
+        for name,value in sorted(_counters.items()):
+            lines.append('%-32s %8s'%(name,value))
+    return '\n'.join(lines)
+
+def _emit():
+    if not (_spans or _values or _counters):
+        return
+    path=os.environ.get('INSTRUMENT_OUTPUT')
+    if path:
+        to_json(path)
+    elif os.environ.get('INSTRUMENT')=='table':
+        sys.stderr.write(summary()+'\n')
+
+atexit.register(_emit)
@@ -1,25 +1,178 @@
 import os
+from datetime import datetime
+from multiprocessing import Pool
+import numpy as np
+from gametable import GameTable, MISSING
+import instrument
 
-def read_folder(folderName):
+#Columns of the schedule CSVs used for edges: team, opponent and W/L
+TEAM_COLUMN=4
+OPPONENT_COLUMN=6
+RESULT_COLUMN=7
+#Columns used for the game table: date ("Monday Apr 6", doubleheaders end in " (1)"), runs and runs allowed
+DATE_COLUMN=2
+RUNS_COLUMN=8
+RUNS_ALLOWED_COLUMN=9
+
+def read_folder(folderName, workers=1):
     """
     Processes the MLB CSV files located in folderName
 
     Args:
         folderName: the relative filepath to the CSV directory
+        workers: the number of processes reading files, see read_folders
 
     Returns:
         teams: a list of the team names
         edges: a dictionary of (team1, team2) -> w/l where w/l is the number of times
             team 1 beat team 2 minus the number of times team 2 beat team 1
     """
-    edges = {}
-    teams = []
-    for filename in os.listdir(folderName):
-        teams.append(filename.split('_')[1])
-        filepath = folderName + "/" + filename
-        edges.update(read_file(filepath))
+    teams = [ filename.split('_')[1] for filename in os.listdir(folderName) ]
+    names, src, dst, spreads = read_folders([folderName], workers)
+    edges = dict(zip(zip(names[src].tolist(), names[dst].tolist()), spreads.tolist()))
     return teams, edges
 
+@instrument.timed('load.read_folders')
+def read_folders(folderNames, workers=1):
+    """
+    Processes the MLB CSV files located in all of folderNames, summing the spreads of
+    team pairs that appear in several files or seasons
+
+    Args:
+        folderNames: a list of relative filepaths to CSV directories, or a single one
+        workers: the number of processes reading files, 1 reads them in this process
+
+    Returns:
+        names: an array of the team names appearing in the files, sorted
+        src: an array of team ids, indices into names
+        dst: an array of opponent ids, one per (team, opponent) pair
+        spreads: an array of the number of times team beat opponent minus the number
+            of times opponent beat team, as seen in the team's files
+    """
+    if isinstance(folderNames, basestring):
+        folderNames = [folderNames]
+    filepaths = [ folderName + "/" + filename for folderName in folderNames for filename in sorted(os.listdir(folderName)) ]
+    instrument.count('load.files', len(filepaths))
+    if workers > 1 and len(filepaths) > 1:
+        pool = Pool(min(workers, len(filepaths)))
+        try:
+            columns = pool.map(_file_spreads, filepaths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        columns = [ _file_spreads(filepath) for filepath in filepaths ]
+    team = [ name for c in columns for name in c[0] ]
+    opponent = [ name for c in columns for name in c[1] ]
+    win = np.fromiter((w for c in columns for w in c[2]), dtype=np.int64, count=len(team))
+    # Team names are interned once, everything after works on integer ids
+    names = np.array(sorted(set(team) | set(opponent)), dtype=str)
+    index = { name : i for i, name in enumerate(names.tolist()) }
+    n = len(names)
+    src = np.fromiter((index[name] for name in team), dtype=np.int64, count=len(team))
+    dst = np.fromiter((index[name] for name in opponent), dtype=np.int64, count=len(opponent))
+    # One key per ordered pair, summed with bincount instead of a dictionary
+    keys, inverse = np.unique(src * n + dst, return_inverse=True)
+    spreads = np.bincount(inverse, weights=win, minlength=len(keys)).astype(np.int64)
+    return names, keys // n, keys % n, spreads
+
+def read_columns(filename):
+    """
+    Reads the team, opponent and result columns of the CSV file located as filename,
+    splitting each line only up to the result column
+
+    Args:
+        filename: the relative filepath to the CSV file
+
+    Returns:
+        team: a list of team names, one per game
+        opponent: a list of opponent names
+        win: a list of 1 where team won and -1 where it lost
+    """
+    with open(filename, 'r') as f:
+        rows = [ line.split(",", RESULT_COLUMN + 1) for line in f.read().splitlines() if line.strip() != '' ]
+    rows = [ row for row in rows if row[TEAM_COLUMN] != "Tm" ]
+    team = [ row[TEAM_COLUMN] for row in rows ]
+    opponent = [ row[OPPONENT_COLUMN] for row in rows ]
+    win = [ 1 if "W" in row[RESULT_COLUMN] else -1 for row in rows ]
+    return team, opponent, win
+
+@instrument.timed('load.read_table')
+def read_table(folderNames, workers=1):
+    """
+    Processes the MLB CSV files located in folderNames into a game table. Every game is listed
+    in the files of both teams, so a row is only kept when the opponent sorts after the team or
+    has no file in the same folder
+
+    Args:
+        folderNames: a list of relative filepaths to CSV directories named after their season,
+            or a single one
+        workers: the number of processes reading files, 1 reads them in this process
+
+    Returns:
+        A gametable.GameTable of the games, with dates and scores
+    """
+    if isinstance(folderNames, basestring):
+        folderNames = [folderNames]
+    tasks = []
+    for folderName in folderNames:
+        season = os.path.basename(os.path.normpath(folderName))
+        season = int(season) if season.isdigit() else MISSING
+        filenames = sorted(os.listdir(folderName))
+        fileTeams = set(filename.split('_')[1] for filename in filenames)
+        tasks.extend((folderName + "/" + filename, season, fileTeams) for filename in filenames)
+    if workers > 1 and len(tasks) > 1:
+        pool = Pool(min(workers, len(tasks)))
+        try:
+            files = pool.map(_read_games, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        files = [ _read_games(task) for task in tasks ]
+    rows = [ row for games in files for row in games ]
+    winners = [ row[0] for row in rows ]
+    losers = [ row[1] for row in rows ]
+    names = sorted(set(winners) | set(losers))
+    index = { name : i for i, name in enumerate(names) }
+    return GameTable.from_columns(names,
+        np.array([ index[name] for name in winners ], dtype=np.int32),
+        np.array([ index[name] for name in losers ], dtype=np.int32),
+        season=np.array([ row[2] for row in rows ], dtype=np.int16),
+        date=np.array([ row[3] for row in rows ], dtype='datetime64[D]'),
+        winner_score=np.array([ row[4] for row in rows ], dtype=np.int16),
+        loser_score=np.array([ row[5] for row in rows ], dtype=np.int16))
+
+#Reads the games of one file for read_table as (winner, loser, season, date, winner runs, loser runs) rows
+def _read_games(task):
+    filename, season, fileTeams = task
+    games = []
+    with open(filename, 'r') as f:
+        for line in f.read().splitlines():
+            row = line.split(",", RUNS_ALLOWED_COLUMN + 1)
+            if line.strip() == '' or row[TEAM_COLUMN] == "Tm":
+                continue
+            team = row[TEAM_COLUMN]
+            opponent = row[OPPONENT_COLUMN]
+            if opponent < team and opponent in fileTeams:
+                continue
+            day = 'NaT'
+            if season != MISSING:
+                day = datetime.strptime(row[DATE_COLUMN].split(" (")[0].split(" ", 1)[1] + " %d" % season, "%b %d %Y").strftime("%Y-%m-%d")
+            runs = int(row[RUNS_COLUMN])
+            allowed = int(row[RUNS_ALLOWED_COLUMN])
+            if "W" in row[RESULT_COLUMN]:
+                games.append((team, opponent, season, day, runs, allowed))
+            else:
+                games.append((opponent, team, season, day, allowed, runs))
+    return games
+
+#Sums the spreads of one file per (team, opponent) pair, so workers send back a few rows per file
+def _file_spreads(filename):
+    spreads = read_file(filename)
+    pairs = spreads.keys()
+    return [ pair[0] for pair in pairs ], [ pair[1] for pair in pairs ], [ spreads[pair] for pair in pairs ]
+
 def read_file(filename):
     """
     Processes the CSV file located as filename
@@ -30,22 +183,10 @@ def read_file(filename):
     Returns:
         edges: a dictionary of (team1, team2) -> w/l as described above
     """
-    f = open(filename, 'r')
+    team, opponent, win = read_columns(filename)
     edges = {}
-    for line in f:
-        line = line.strip()
-        if line == '':
-            continue
-
-        lineComponents = line.split(",")
-        team1 = lineComponents[4]
-        team2 = lineComponents[6]
-
-        if team1 == "Tm":
-            continue
-
-        win = 1 if "W" in lineComponents[7] else -1
-        edges[(team1, team2)] = edges.get((team1, team2), 0) + win
+    for pair, w in zip(zip(team, opponent), win):
+        edges[pair] = edges.get(pair, 0) + w
     return edges
 
 if __name__=='__main__':
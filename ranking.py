@@ -1,8 +1,13 @@
+import multiprocessing
 import snap
+import numpy as np
 import process_mlb
 import sportsdata
 import random
 import syntheticgraph
+from folds import run_folds
+from gametable import GameTable
+import instrument
 
 MLB_2015_STANDINGS = ['STL', 'PIT', 'CHC', 'KC', 'TOR', 'LA', 'NYM', 'TEX', 'NYY', 'HOU', 'ANA', 'SF', 'WAS', 'MIN', 'CLE', 'BAL', 'TB', 'ARI', 'BOS', 'SEA', 'CWS', 'DET', 'SD', 'MIA', 'MIL', 'OAK', 'COL', 'ATL', 'CIN', 'PHI']
 NFL_2015_STANDINGS = ['CAR', 'DEN', 'SEA', 'ARI', 'NE', 'CIN', 'PIT', 'KC', 'MIN', 'GB', 'WAS', 'NYJ', 'HOU', 'BUF', 'ATL', 'OAK', 'IND', 'PHI', 'NO', 'DET', 'MIA', 'STL', 'NYG', 'TB', 'CHI', 'BAL', 'JAC', 'SD', 'SF', 'DAL', 'TEN', 'CLE']
@@ -37,6 +42,27 @@ def ranking(graph, alpha=0.6, primary=degreeDifference, secondary=randomValue, e
         edgeAttrs (dict): edge attributes for use with sorting key functions
     Returns:
         A list of node IDs ordered in descending order by ranking
+
+    When primary and secondary are both among degreeDifference, edgeWeightDifference and
+    randomValue the ranking is computed by rankingArrays, which gives the same order (and
+    draws the same random numbers) without building subgraphs.
+    """
+    if primary in ARRAY_KEYS and secondary in ARRAY_KEYS:
+        nodeIDs = [ node.GetId() for node in graph.Nodes() ]
+        index = { nodeID : i for i, nodeID in enumerate(nodeIDs) }
+        edges = [ (edge.GetSrcNId(), edge.GetDstNId()) for edge in graph.Edges() ]
+        src = np.array([ index[edge[0]] for edge in edges ], dtype=np.int64)
+        dst = np.array([ index[edge[1]] for edge in edges ], dtype=np.int64)
+        weights = None
+        if edgeWeightDifference in (primary, secondary):
+            weights = np.array([ edgeAttrs[(edge[1], edge[0])] for edge in edges ])
+        return [ nodeIDs[i] for i in rankingArrays(len(nodeIDs), src, dst, alpha, primary, secondary, weights) ]
+    return subgraphRanking(graph, alpha, primary, secondary, edgeAttrs)
+
+def subgraphRanking(graph, alpha=0.6, primary=degreeDifference, secondary=randomValue, edgeAttrs=None):
+    """
+    The recursive implementation of ranking, which calls the sorting keys on SNAP subgraphs
+    and so works with any key functions. Arguments and return value are as for ranking.
     """
     
     # Group the nodes by degree difference (d_in - d_out)
@@ -67,7 +93,129 @@ def ranking(graph, alpha=0.6, primary=degreeDifference, secondary=randomValue, e
     followerGraph = snap.GetSubGraph(graph, followerNIdVector)
 
     # Recurse on the leaders and followers
-    return ranking(leaderGraph, alpha, primary, secondary, edgeAttrs) + ranking(followerGraph, alpha, primary, secondary, edgeAttrs)
+    return subgraphRanking(leaderGraph, alpha, primary, secondary, edgeAttrs) + subgraphRanking(followerGraph, alpha, primary, secondary, edgeAttrs)
+
+# Sorting keys that rankingArrays computes natively
+ARRAY_KEYS = { degreeDifference : 'degree', edgeWeightDifference : 'weight', randomValue : 'random' }
+
+@instrument.timed('ranking.rank')
+def rankingArrays(numNodes, src, dst, alpha=0.6, primary=degreeDifference, secondary=randomValue, weights=None, rootOrder=None):
+    """
+    Array implementation of ranking over nodes 0, ..., numNodes - 1. Instead of building two
+    subgraphs per level it keeps the nodes in one index array where every partition is a
+    contiguous range, sorts all partitions of a level with a single lexsort, and updates the
+    degrees of the induced subgraphs by subtracting the edges that a split cuts.
+
+    Args:
+        numNodes (int): the number of nodes
+        src (array): the source of every edge (the loser, as in createGraph)
+        dst (array): the destination of every edge (the winner)
+        alpha (float): the relative size of the leader partition
+        primary: degreeDifference, edgeWeightDifference or randomValue
+        secondary: degreeDifference, edgeWeightDifference or randomValue
+        weights (array): the weight of every edge, edgeAttrs[(dst, src)] in ranking, needed for
+            edgeWeightDifference
+        rootOrder (array): the sorted order of all nodes, as returned with alpha=0, to skip the
+            first sort. It does not depend on alpha, so sweeps can share it (not with random keys)
+
+    Returns:
+        An array of node indices ordered in descending order by ranking. It matches ranking on
+        the graph with nodes added in index order: ties keep the previous order, random values
+        are drawn from random in the order the recursion would draw them, and weight differences
+        are summed in SNAP's edge order so that floating point ties break the same way.
+    """
+    keys = (ARRAY_KEYS[primary], ARRAY_KEYS[secondary])
+    numRandom = keys.count('random')
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+    elif 'weight' in keys:
+        raise ValueError("edgeWeightDifference needs edge weights")
+
+    # Random draws for a partition of size n: n per random key for the partition itself, then
+    # the draws of the leader subtree followed by those of the follower subtree
+    drawCounts = {}
+    def subtreeDraws(n):
+        if n not in drawCounts:
+            split = int(alpha * n)
+            total = n * numRandom
+            if split > 0 and n - split > 0:
+                total += subtreeDraws(split) + subtreeDraws(n - split)
+            drawCounts[n] = total
+        return drawCounts[n]
+    draws = np.array([ random.random() for i in range(subtreeDraws(numNodes)) ])
+
+    # Keep the edges in SNAP's order (in edges by source, out edges by destination) so the
+    # weight differences are accumulated in the same order as edgeWeightDifference
+    inOrder = np.lexsort((src, dst))
+    outOrder = np.lexsort((dst, src))
+    inDegree = np.bincount(dst, minlength=numNodes)
+    outDegree = np.bincount(src, minlength=numNodes)
+
+    order = np.arange(numNodes)
+    segment = np.zeros(numNodes, dtype=np.int64)
+    starts = np.array([0], dtype=np.int64)
+    ends = np.array([numNodes], dtype=np.int64)
+    offsets = np.array([0], dtype=np.int64)
+    if numNodes == 0:
+        return order
+    while len(starts) > 0:
+        sizes = ends - starts
+        segmentIndex = np.repeat(np.arange(len(starts)), sizes)
+        local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        positions = starts[segmentIndex] + local
+        nodes = order[positions]
+
+        if rootOrder is not None and numRandom == 0:
+            order[:] = rootOrder
+            rootOrder = None
+        else:
+            if 'weight' in keys:
+                strength = np.bincount(np.concatenate((dst[inOrder], src[outOrder])),
+                                       np.concatenate((weights[inOrder], -weights[outOrder])), minlength=numNodes)
+            values = []
+            for i, key in enumerate(keys):
+                if key == 'degree':
+                    values.append(inDegree[nodes] - outDegree[nodes])
+                elif key == 'weight':
+                    values.append(strength[nodes])
+                else:
+                    values.append(draws[offsets[segmentIndex] + local * numRandom + (i if numRandom == 2 else 0)])
+
+            # Stable sort inside each partition, descending by (primary, secondary)
+            order[positions] = nodes[np.lexsort((-values[1], -values[0], segmentIndex))]
+
+        # Split the partitions, those with an empty side are final
+        splits = (alpha * sizes).astype(np.int64)
+        recurse = (splits > 0) & (sizes - splits > 0)
+        leaderStarts = starts[recurse]
+        leaderEnds = leaderStarts + splits[recurse]
+        leaderOffsets = offsets[recurse] + sizes[recurse] * numRandom
+        followerOffsets = leaderOffsets + np.array([ subtreeDraws(n) for n in splits[recurse] ], dtype=np.int64)
+        starts = np.concatenate((leaderStarts, leaderEnds))
+        ends = np.concatenate((leaderEnds, ends[recurse]))
+        offsets = np.concatenate((leaderOffsets, followerOffsets))
+
+        # Relabel the nodes by their new partition, and drop the edges that no longer lie
+        # inside one partition from the degrees
+        segment[nodes] = -1
+        sizes = ends - starts
+        newPositions = np.repeat(starts, sizes) + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        segment[order[newPositions]] = np.repeat(np.arange(len(starts)), sizes)
+        keep = (segment[src] == segment[dst]) & (segment[src] >= 0)
+        inDegree -= np.bincount(dst[~keep], minlength=numNodes)
+        outDegree -= np.bincount(src[~keep], minlength=numNodes)
+        inOrder = inOrder[keep[inOrder]]
+        outOrder = outOrder[keep[outOrder]]
+        newIndex = np.cumsum(keep) - 1
+        inOrder = newIndex[inOrder]
+        outOrder = newIndex[outOrder]
+        src = src[keep]
+        dst = dst[keep]
+        if weights is not None:
+            weights = weights[keep]
+    return order
 
 def graphRankingEvaluation(graph, ranking):
     """
@@ -83,19 +231,17 @@ def graphRankingEvaluation(graph, ranking):
     Returns:
         A float representing the proportion of accurately predicted nodes.
     """
-    # Generate a mapping of node to ranking for quick lookup
-    rankingMap = {}
-    for i in range(len(ranking)):
-        rankingMap[ranking[i]] = i
-    
-    # Iterate through the edges
-    correctCount = 0
-    for edge in graph.Edges():
-        sourceRank = rankingMap[edge.GetSrcNId()]
-        destRank = rankingMap[edge.GetDstNId()]
-
-        if destRank <= sourceRank:
-            correctCount += 1
+    # Positions of the node ids, looked up for all edges at once
+    positions = np.full(max(ranking) + 1 if len(ranking) else 0, -1, dtype=np.int64)
+    positions[np.array(ranking, dtype=np.int64)] = np.arange(len(ranking))
+    edges = np.array([ (edge.GetSrcNId(), edge.GetDstNId()) for edge in graph.Edges() ], dtype=np.int64).reshape(-1, 2)
+    # Nodes missing from the ranking raise KeyError, as looking them up in a dictionary would
+    outside = (edges < 0) | (edges >= len(positions))
+    if np.any(outside):
+        raise KeyError(edges[outside][0])
+    if np.any(positions[edges] < 0):
+        raise KeyError(edges[positions[edges] < 0][0])
+    correctCount = np.count_nonzero(positions[edges[:, 1]] <= positions[edges[:, 0]])
 
     return correctCount * 1.0 / graph.GetEdges()
 
@@ -107,19 +253,21 @@ def gameRankingEvaluation(games, ranking):
     of games.
 
     Args:
-        games (list): a list of games represented as tuples (loser, winner)
+        games (list): a list of games represented as tuples (loser, winner), or a gametable.GameTable
         ranking (list): a ranking of the teams, ordered from high to low
 
     Returns:
         A float representing the proportion of accurately predicted games
     """
+    if isinstance(games, GameTable):
+        games = games.pairs()
 
     # Generate a mapping of team to ranking for quick lookup
     rankingMap = {}
     for i in range(len(ranking)):
         rankingMap[ranking[i]] = i
 
-    # Iterate through the games
+    # Iterate through the games, games with unranked teams count as missed
     correctCount = 0
     for game in games:
         try:
@@ -127,12 +275,85 @@ def gameRankingEvaluation(games, ranking):
             loserIndex= rankingMap[game[1]]
             if loserIndex > winnerIndex:
                 correctCount += 1
-        except:
+        except KeyError:
             pass
     
     return correctCount * 1.0 / len(games)
 
-def rankingTest():
+def rankingPositions(rankings, teams):
+    """
+    Converts rankings into a matrix of positions over a fixed list of teams.
+
+    Args:
+        rankings (list): rankings as lists of team names ordered from high to low, or an
+            R x K integer array whose rows are team ids (indices into teams) ordered from high to low
+        teams (list): the team names that index the columns
+
+    Returns:
+        An R x (N + 1) array where [r, i] is the position of teams[i] in ranking r and -1 if the
+        ranking leaves it out. The last column is always -1 and stands for teams not in teams
+    """
+    if isinstance(rankings, np.ndarray) and rankings.dtype.kind in 'iu':
+        orders = rankings.reshape(len(rankings), -1)
+    else:
+        index = { team : i for i, team in enumerate(teams) }
+        width = max([ len(ranking) for ranking in rankings ] + [0])
+        orders = np.full((len(rankings), width), len(teams), dtype=np.int64)
+        for r, ranking in enumerate(rankings):
+            orders[r, :len(ranking)] = [ index.get(team, len(teams)) for team in ranking ]
+    positions = np.full((len(orders), len(teams) + 1), -1, dtype=np.int64)
+    positions[np.arange(len(orders))[:, None], orders] = np.arange(orders.shape[1])
+    positions[:, -1] = -1
+    return positions
+
+@instrument.timed('eval.rankings')
+def evaluateRankings(rankings, games, teams=None, chunk=1024):
+    """
+    Scores many rankings against the same games at once. Each accuracy matches
+    gameRankingEvaluation for that ranking: a game counts when the winner is ranked above the
+    loser, and games with an unranked team count as missed.
+
+    Args:
+        rankings (list): rankings as taken by rankingPositions
+        games (list): (winner, loser) tuples, or a gametable.GameTable
+        teams (list): the team names integer rankings refer to. Defaults to the table's teams, or
+            to the sorted names in games and rankings
+        chunk (int): the number of rankings scored together, bounding memory to chunk x games
+
+    Returns:
+        (accuracies, unknown) arrays with one entry per ranking, unknown counting the games where
+        the ranking leaves out the winner or the loser
+    """
+    if isinstance(games, GameTable):
+        if teams is None:
+            teams = games.teams
+        index = { team : i for i, team in enumerate(teams) }
+        remap = np.array([ index.get(team, len(teams)) for team in games.teams ] + [len(teams)], dtype=np.int64)
+        winners = remap[games.games['winner']]
+        losers = remap[games.games['loser']]
+    else:
+        games = list(games)
+        if teams is None:
+            names = set(team for game in games for team in game)
+            if not isinstance(rankings, np.ndarray):
+                names.update(team for ranking in rankings for team in ranking)
+            teams = sorted(names)
+        index = { team : i for i, team in enumerate(teams) }
+        winners = np.array([ index.get(game[0], len(teams)) for game in games ], dtype=np.int64)
+        losers = np.array([ index.get(game[1], len(teams)) for game in games ], dtype=np.int64)
+    positions = rankingPositions(rankings, teams)
+    correct = np.zeros(len(positions), dtype=np.int64)
+    unknown = np.zeros(len(positions), dtype=np.int64)
+    for start in range(0, len(positions), chunk):
+        block = positions[start:start + chunk]
+        winnerPositions = block[:, winners]
+        loserPositions = block[:, losers]
+        known = (winnerPositions >= 0) & (loserPositions >= 0)
+        correct[start:start + chunk] = np.count_nonzero(known & (loserPositions > winnerPositions), axis=1)
+        unknown[start:start + chunk] = len(winners) - np.count_nonzero(known, axis=1)
+    return correct * 1.0 / len(winners), unknown
+
+def rankingTest(workers=None):
     """
     Run analysis on the MLB and NFL graphs. For each league, we:
         1) Generate our own ranking for 2015
@@ -141,147 +362,29 @@ def rankingTest():
         4) Calculate the Levenshtein (edit) distance between 2015 rankings
         5) Generate a ranking for 2012-2014 data
         6) Determine how accurately our historical ranking reflects 2015 games
-    """
-    # Results for 2015 MLB data
-    randomResults = []
-    edgeWeightPrimaryResults = []
-    edgeWeightSecondaryResults = []
-
-    teams, edgeWeights = sportsdata.getMLBEdges(2015, 2015)
-    edgeWeights = { edge : weight for edge, weight in edgeWeights.items() if weight > 0 } 
-    currentGraph = createGraph(teams, edgeWeights)
-    games = sportsdata.getMLBGames(2015)
-    edgeWeights = { (teams.index(edge[0]), teams.index(edge[1])) : weight for edge, weight in edgeWeights.items() }
-    for alpha in [ j * 0.1 for j in range(1, 10) ]:
-        randomRanking = [ teams[i] for i in ranking(currentGraph, alpha) ]
-        edgeWeightPrimaryRanking = [ teams[i] for i in ranking(currentGraph, alpha, edgeWeightDifference, randomValue, edgeWeights) ]
-        edgeWeightSecondaryRanking = [ teams[i] for i in ranking(currentGraph, alpha, degreeDifference, edgeWeightDifference, edgeWeights) ]
-
-        randomAccuracy = gameRankingEvaluation(games, randomRanking)
-        edgeWeightPrimaryAccuracy = gameRankingEvaluation(games, edgeWeightPrimaryRanking)
-        edgeWeightSecondaryAccuracy = gameRankingEvaluation(games, edgeWeightSecondaryRanking)
-
-        randomDistance = levenshtein(randomRanking, MLB_2015_STANDINGS)
-        edgeWeightPrimaryDistance = levenshtein(edgeWeightPrimaryRanking, MLB_2015_STANDINGS)
-        edgeWeightSecondaryDistance = levenshtein(edgeWeightSecondaryRanking, MLB_2015_STANDINGS)
-
-        randomResults.append((alpha, randomRanking, randomAccuracy, randomDistance))
-        edgeWeightPrimaryResults.append((alpha, edgeWeightPrimaryRanking, edgeWeightPrimaryAccuracy, edgeWeightPrimaryDistance))
-        edgeWeightSecondaryResults.append((alpha, edgeWeightSecondaryRanking, edgeWeightSecondaryAccuracy, edgeWeightSecondaryDistance))
-
-    randomOptimal = max(randomResults, key=lambda result: result[2])
-    edgeWeightPrimaryOptimal = max(edgeWeightPrimaryResults, key=lambda result: result[2])
-    edgeWeightSecondaryOptimal = max(edgeWeightSecondaryResults, key=lambda result: result[2])
-
-    # Predicting with 2012-2014 data
-    randomResults = []
-    edgeWeightPrimaryResults = []
-    edgeWeightSecondaryResults = []
-    for gamma in [ i * 0.1 for i in range(0, 11) ]:
-        (teams, edgeWeights) = sportsdata.getMLBEdges(2012, 2014, gamma)
-        edgeWeights = { edge : weight for edge, weight in edgeWeights.items() if weight > 0 } 
-        historicalGraph = createGraph(teams, edgeWeights)
-        edgeWeights = { (teams.index(edge[0]), teams.index(edge[1])) : weight for edge, weight in edgeWeights.items() }
-        for alpha in [ j * 0.1 for j in range(1, 10) ]:
-            randomRanking = [ teams[i] for i in ranking(historicalGraph, alpha) ]
-            edgeWeightPrimaryRanking = [ teams[i] for i in ranking(historicalGraph, alpha, edgeWeightDifference, randomValue, edgeWeights) ]
-            edgeWeightSecondaryRanking = [ teams[i] for i in ranking(historicalGraph, alpha, degreeDifference, edgeWeightDifference, edgeWeights) ]
-
-            randomAccuracy = gameRankingEvaluation(games, randomRanking)
-            edgeWeightPrimaryAccuracy = gameRankingEvaluation(games, edgeWeightPrimaryRanking)
-            edgeWeightSecondaryAccuracy = gameRankingEvaluation(games, edgeWeightSecondaryRanking)
-
-            randomDistance = levenshtein(randomRanking, MLB_2015_STANDINGS)
-            edgeWeightPrimaryDistance = levenshtein(edgeWeightPrimaryRanking, MLB_2015_STANDINGS)
-            edgeWeightSecondaryDistance = levenshtein(edgeWeightSecondaryRanking, MLB_2015_STANDINGS)
-
-            randomResults.append((gamma, alpha, randomRanking, randomAccuracy, randomDistance))
-            edgeWeightPrimaryResults.append((gamma, alpha, edgeWeightPrimaryRanking, edgeWeightPrimaryAccuracy, edgeWeightPrimaryDistance))
-            edgeWeightSecondaryResults.append((gamma, alpha, edgeWeightSecondaryRanking, edgeWeightSecondaryAccuracy, edgeWeightSecondaryDistance))
-
-    histRandomOptimal = max(randomResults, key=lambda result: result[3])
-    histEdgeWeightPrimaryOptimal = max(edgeWeightPrimaryResults, key=lambda result: result[3])
-    histEdgeWeightSecondaryOptimal = max(edgeWeightSecondaryResults, key=lambda result: result[3])
-
-    print "MLB Results"
-    print "==========="
-    print "DR", randomOptimal
-    print "EWR", edgeWeightPrimaryOptimal
-    print "DEW", edgeWeightSecondaryOptimal
-    print "Actual ranking", gameRankingEvaluation(games, MLB_2015_STANDINGS)
-    print "Historical DR", histRandomOptimal
-    print "Historical EWR", histEdgeWeightPrimaryOptimal
-    print "Historical DEW", histEdgeWeightSecondaryOptimal
-
-    randomResults = []
-    edgeWeightPrimaryResults = []
-    edgeWeightSecondaryResults = []
-
-    teams, edgeWeights = sportsdata.getNFLEdges(2015, 2015)
-    edgeWeights = { edge : weight for edge, weight in edgeWeights.items() if weight > 0 } 
-    currentGraph = createGraph(teams, edgeWeights)
-    games = sportsdata.getNFLGames(2015)
-    edgeWeights = { (teams.index(edge[0]), teams.index(edge[1])) : weight for edge, weight in edgeWeights.items() }
-    for alpha in [ j * 0.1 for j in range(1, 10) ]:
-        randomRanking = [ teams[i] for i in ranking(currentGraph, alpha) ]
-        edgeWeightPrimaryRanking = [ teams[i] for i in ranking(currentGraph, alpha, edgeWeightDifference, randomValue, edgeWeights) ]
-        edgeWeightSecondaryRanking = [ teams[i] for i in ranking(currentGraph, alpha, degreeDifference, edgeWeightDifference, edgeWeights) ]
-
-        randomAccuracy = gameRankingEvaluation(games, randomRanking)
-        edgeWeightPrimaryAccuracy = gameRankingEvaluation(games, edgeWeightPrimaryRanking)
-        edgeWeightSecondaryAccuracy = gameRankingEvaluation(games, edgeWeightSecondaryRanking)
-
-        randomDistance = levenshtein(randomRanking, MLB_2015_STANDINGS)
-        edgeWeightPrimaryDistance = levenshtein(edgeWeightPrimaryRanking, MLB_2015_STANDINGS)
-        edgeWeightSecondaryDistance = levenshtein(edgeWeightSecondaryRanking, MLB_2015_STANDINGS)
-
-        randomResults.append((alpha, randomRanking, randomAccuracy, randomDistance))
-        edgeWeightPrimaryResults.append((alpha, edgeWeightPrimaryRanking, edgeWeightPrimaryAccuracy, edgeWeightPrimaryDistance))
-        edgeWeightSecondaryResults.append((alpha, edgeWeightSecondaryRanking, edgeWeightSecondaryAccuracy, edgeWeightSecondaryDistance))
-
-    randomOptimal = max(randomResults, key=lambda result: result[2])
-    edgeWeightPrimaryOptimal = max(edgeWeightPrimaryResults, key=lambda result: result[2])
-    edgeWeightSecondaryOptimal = max(edgeWeightSecondaryResults, key=lambda result: result[2])
-
-    # Predicting with 2012-2014 data
-    randomResults = []
-    edgeWeightPrimaryResults = []
-    edgeWeightSecondaryResults = []
-    for gamma in [ i * 0.1 for i in range(0, 11) ]:
-        (teams, edgeWeights) = sportsdata.getNFLEdges(2012, 2014, gamma)
-        edgeWeights = { edge : weight for edge, weight in edgeWeights.items() if weight > 0 } 
-        historicalGraph = createGraph(teams, edgeWeights)
-        edgeWeights = { (teams.index(edge[0]), teams.index(edge[1])) : weight for edge, weight in edgeWeights.items() }
-        for alpha in [ j * 0.1 for j in range(1, 10) ]:
-            randomRanking = [ teams[i] for i in ranking(historicalGraph, alpha) ]
-            edgeWeightPrimaryRanking = [ teams[i] for i in ranking(historicalGraph, alpha, edgeWeightDifference, randomValue, edgeWeights) ]
-            edgeWeightSecondaryRanking = [ teams[i] for i in ranking(historicalGraph, alpha, degreeDifference, edgeWeightDifference, edgeWeights) ]
-
-            randomAccuracy = gameRankingEvaluation(games, randomRanking)
-            edgeWeightPrimaryAccuracy = gameRankingEvaluation(games, edgeWeightPrimaryRanking)
-            edgeWeightSecondaryAccuracy = gameRankingEvaluation(games, edgeWeightSecondaryRanking)
-
-            randomDistance = levenshtein(randomRanking, NFL_2015_STANDINGS)
-            edgeWeightPrimaryDistance = levenshtein(edgeWeightPrimaryRanking, NFL_2015_STANDINGS)
-            edgeWeightSecondaryDistance = levenshtein(edgeWeightSecondaryRanking, NFL_2015_STANDINGS)
-
-            randomResults.append((gamma, alpha, randomRanking, randomAccuracy, randomDistance))
-            edgeWeightPrimaryResults.append((gamma, alpha, edgeWeightPrimaryRanking, edgeWeightPrimaryAccuracy, edgeWeightPrimaryDistance))
-            edgeWeightSecondaryResults.append((gamma, alpha, edgeWeightSecondaryRanking, edgeWeightSecondaryAccuracy, edgeWeightSecondaryDistance))
-
-    histRandomOptimal = max(randomResults, key=lambda result: result[3])
-    histEdgeWeightPrimaryOptimal = max(edgeWeightPrimaryResults, key=lambda result: result[3])
-    histEdgeWeightSecondaryOptimal = max(edgeWeightSecondaryResults, key=lambda result: result[3])
 
-    print "NFL Results"
-    print "==========="
-    print "DR", randomOptimal
-    print "EWR", edgeWeightPrimaryOptimal
-    print "DEW", edgeWeightSecondaryOptimal
-    print "Actual ranking", gameRankingEvaluation(games, NFL_2015_STANDINGS)
-    print "Historical DR", histRandomOptimal
-    print "Historical EWR", histEdgeWeightPrimaryOptimal
-    print "Historical DEW", histEdgeWeightSecondaryOptimal
+    Args:
+        workers (int): the number of worker processes of the sweeps, one per CPU if None
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    for league, getEdges, getGames, standings in [ ("MLB", sportsdata.getMLBEdges, sportsdata.getMLBGames, MLB_2015_STANDINGS),
+                                                   ("NFL", sportsdata.getNFLEdges, sportsdata.getNFLGames, NFL_2015_STANDINGS) ]:
+        games = getGames(2015)
+        teams, edgeWeights = getEdges(2015, 2015)
+        current = rankingSweep([ (1.0, teams, edgeWeights) ], games, standings, workers=workers)
+        # Every gamma comes out of one weighted sum of the cached season matrices
+        batch = sportsdata.getEdgeBatch(league.lower(), 2012, 2014, SWEEP_GAMMAS)
+        historical = rankingSweep([ (gamma,) + edges for gamma, edges in zip(SWEEP_GAMMAS, batch) ], games, standings,
+                                  workers=workers)
+
+        print league, "Results"
+        print "==========="
+        for name, primary, secondary in SWEEP_STRATEGIES:
+            print name, optimalResult(current, name)
+        print "Actual ranking", gameRankingEvaluation(games, standings)
+        for name, primary, secondary in SWEEP_STRATEGIES:
+            print "Historical", name, optimalResult(historical, name)
 
     """
     (teams, edgeDict) = sportsdata.getMLBEdges(2015, 2015)
@@ -348,6 +451,122 @@ def rankingTest():
     print rankingEvaluation(historicalSynthGraph, range(1000))
     """
 
+# Key strategies swept by rankingSweep: (name, primary, secondary)
+SWEEP_STRATEGIES = [ ("DR", degreeDifference, randomValue),
+                     ("EWR", edgeWeightDifference, randomValue),
+                     ("DEW", degreeDifference, edgeWeightDifference) ]
+SWEEP_ALPHAS = [ j * 0.1 for j in range(1, 10) ]
+SWEEP_GAMMAS = [ i * 0.1 for i in range(0, 11) ]
+
+SWEEP_DTYPE = [ ('gamma', np.float64), ('alpha', np.float64), ('strategy', 'S8'),
+                ('accuracy', np.float64), ('distance', np.int64), ('kendall', np.float64), ('ranking', object) ]
+
+def graphArrays(teams, edgeWeights):
+    """
+    Converts a dictionary of (winner, loser) -> spread into the arrays rankingArrays works on,
+    with the same node numbering and edges as createGraph. Only positive spreads become edges.
+
+    Returns:
+        (src, dst, weights) where each edge points from the loser to the winner
+    """
+    index = { team : i for i, team in enumerate(teams) }
+    edges = [ (edge, weight) for edge, weight in edgeWeights.items() if weight > 0 ]
+    src = np.array([ index[edge[1]] for edge, weight in edges ], dtype=np.int64)
+    dst = np.array([ index[edge[0]] for edge, weight in edges ], dtype=np.int64)
+    weights = np.array([ weight for edge, weight in edges ], dtype=np.float64)
+    return src, dst, weights
+
+def tableArrays(table, gamma=1.0):
+    """
+    Converts a gametable.GameTable into the arrays rankingArrays works on, using the spreads of
+    GameTable.spread_arrays discounted by gamma. Only positive spreads become edges.
+
+    Returns:
+        (teams, src, dst, weights) where each edge points from the loser to the winner
+    """
+    winners, losers, spreads = table.spread_arrays(gamma)
+    positive = spreads > 0
+    return list(table.teams), losers[positive], winners[positive], spreads[positive]
+
+# Set in each worker process once by _initSweepWorker
+_sweepState = None
+
+def _initSweepWorker(state):
+    global _sweepState
+    _sweepState = state
+
+def _sweepTask(taskIndex):
+    graphs, tasks, standings, seed = _sweepState
+    graphIndex, alpha, strategyIndex = tasks[taskIndex]
+    gamma, teams, src, dst, weights, rootOrders = graphs[graphIndex]
+    name, primary, secondary = SWEEP_STRATEGIES[strategyIndex]
+    random.seed(seed + taskIndex)
+    order = rankingArrays(len(teams), src, dst, alpha, primary, secondary, weights, rootOrders[strategyIndex])
+    teamRanking = [ teams[i] for i in order ]
+    return (gamma, alpha, name, 0.0, levenshtein(teamRanking, standings), 0.0, teamRanking)
+
+@instrument.timed('ranking.sweep')
+def rankingSweep(graphs, games, standings, alphas=SWEEP_ALPHAS, strategies=None, workers=1, seed=None):
+    """
+    Ranks every graph for every alpha and key strategy, and scores each ranking.
+
+    Each graph's arrays are built once, and for strategies without random keys the first
+    sorted ordering (which does not depend on alpha) is computed once and shared by all alphas.
+    The (graph, alpha, strategy) grid is then spread over a process pool.
+
+    Args:
+        graphs (list): (gamma, teams, edgeWeights) tuples, edgeWeights as from sportsdata.getMLBEdges,
+            or (gamma, table) tuples with a gametable.GameTable discounted by gamma
+        games (list): the (winner, loser) games to evaluate the rankings on, or a gametable.GameTable
+        standings (list): the reference ranking for the Levenshtein distance
+        alphas (list): the leader partition sizes to try
+        strategies (list): names from SWEEP_STRATEGIES to run, all of them if None
+        workers (int): the number of worker processes, 1 runs in this process
+        seed (int): random keys are seeded with seed plus the task index, so results do not
+            depend on workers. Drawn from random when None
+
+    Returns:
+        A numpy structured array with fields gamma, alpha, strategy, accuracy, distance
+        (Levenshtein), kendall (see topKKendallMany) and ranking, one row per (graph, alpha, strategy)
+    """
+    if seed is None:
+        seed = random.randint(0, 2**30)
+    strategyIndices = [ i for i, strategy in enumerate(SWEEP_STRATEGIES) if strategies is None or strategy[0] in strategies ]
+    graphData = []
+    for graph in graphs:
+        if isinstance(graph[1], GameTable):
+            gamma, table = graph
+            teams, src, dst, weights = tableArrays(table, gamma)
+        else:
+            gamma, teams, edgeWeights = graph
+            teams = list(teams)
+            src, dst, weights = graphArrays(teams, edgeWeights)
+        rootOrders = []
+        for name, primary, secondary in SWEEP_STRATEGIES:
+            rootOrder = None
+            if randomValue not in (primary, secondary):
+                rootOrder = rankingArrays(len(teams), src, dst, 0.0, primary, secondary, weights)
+            rootOrders.append(rootOrder)
+        graphData.append((gamma, teams, src, dst, weights, rootOrders))
+    tasks = [ (graphIndex, alpha, strategyIndex) for graphIndex in range(len(graphData)) for alpha in alphas for strategyIndex in strategyIndices ]
+    rows = run_folds(_sweepTask, _initSweepWorker, (graphData, tasks, standings, seed), len(tasks), workers)
+    results = np.zeros(len(rows), dtype=SWEEP_DTYPE)
+    for i, row in enumerate(rows):
+        results[i] = row
+    if len(rows):
+        results['accuracy'] = evaluateRankings([ row[-1] for row in rows ], games)[0]
+        # Top-k Kendall over all standings teams, which is the Kendall tau distance when the
+        # teams match and still defined when team names differ between sources
+        results['kendall'] = topKKendallMany([ row[-1] for row in rows ], standings, len(standings))
+    return results
+
+def optimalResult(results, strategy):
+    """
+    Returns the first row of a rankingSweep table with the highest accuracy for a strategy
+    """
+    rows = results[results['strategy'] == strategy]
+    return rows[np.argmax(rows['accuracy'])]
+
 def createGraph(nodes, edgeDict):
     graph = snap.TNGraph.New()
     for i in range(len(nodes)):
@@ -382,5 +601,198 @@ def levenshtein(a,b):
             
     return current[n]
 
+def _inversions(sequence):
+    """
+    Counts the pairs i < j with sequence[i] > sequence[j] by merge sort, in O(n log n).
+
+    Returns:
+        (inversions, sortedSequence)
+    """
+    if len(sequence) <= 1:
+        return 0, list(sequence)
+    middle = len(sequence) // 2
+    leftCount, left = _inversions(sequence[:middle])
+    rightCount, right = _inversions(sequence[middle:])
+    merged = []
+    count = leftCount + rightCount
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if right[j] < left[i]:
+            # right[j] is smaller than everything left in left
+            count += len(left) - i
+            merged.append(right[j])
+            j += 1
+        else:
+            merged.append(left[i])
+            i += 1
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+    return count, merged
+
+def _referencePositions(rankings, reference):
+    """
+    Positions of every ranking's teams over the reference, as in rankingPositions with
+    the reference order as team order. Full (not top-k) metrics need permutations.
+    """
+    positions = rankingPositions(rankings, reference)[:, :-1]
+    if (positions < 0).any() or any(len(ranking) != len(reference) for ranking in rankings):
+        raise ValueError("Rankings must be permutations of the reference")
+    return positions
+
+def kendallTau(a, b):
+    """
+    Calculates the Kendall tau distance between two rankings of the same teams: the number
+    of team pairs they order differently. Counted as the inversions of b's positions in a,
+    in O(n log n).
+    """
+    return _inversions(_referencePositions([b], a)[0].tolist())[0]
+
+def kendallTauMany(rankings, reference):
+    """
+    Calculates the Kendall tau distance of many rankings to one reference. The inversions of
+    all rankings are counted together with a Fenwick tree whose every update and query is an
+    array operation over the rankings, so the work is O(R n log n) in O(n log n) NumPy calls.
+
+    Args:
+        rankings (list): rankings as taken by rankingPositions, each a permutation of reference
+        reference (list): the reference ranking, from high to low
+
+    Returns:
+        An integer array with the distance of each ranking
+    """
+    positions = _referencePositions(rankings, reference)
+    numRankings, n = positions.shape
+    # sequence[r, i] is the reference position of the team ranking r puts at i
+    sequence = np.argsort(positions, axis=1)
+    rows = np.arange(numRankings)
+    tree = np.zeros((numRankings, n + 1), dtype=np.int64)
+    inversions = np.zeros(numRankings, dtype=np.int64)
+    for i in range(n):
+        value = sequence[:, i] + 1
+        # Count the earlier values that are not larger, the rest of the i earlier values are inversions
+        index = value.copy()
+        smaller = np.zeros(numRankings, dtype=np.int64)
+        while (index > 0).any():
+            smaller += tree[rows, index]
+            index -= index & -index
+        inversions += i - smaller
+        index = value.copy()
+        while (index <= n).any():
+            live = index <= n
+            tree[rows[live], index[live]] += 1
+            index[live] += index[live] & -index[live]
+    return inversions
+
+def spearmanFootrule(a, b):
+    """
+    Calculates the Spearman footrule distance between two rankings of the same teams, the
+    sum over teams of the difference of their positions.
+    """
+    return spearmanFootruleMany([b], a)[0]
+
+def spearmanFootruleMany(rankings, reference):
+    """
+    Calculates the Spearman footrule distance of many rankings to one reference.
+
+    Returns:
+        An integer array with the distance of each ranking
+    """
+    positions = _referencePositions(rankings, reference)
+    return np.abs(positions - np.arange(len(reference))).sum(axis=1)
+
+def spearmanRho(a, b):
+    """
+    Calculates the Spearman rank correlation between two rankings of the same teams,
+    1 for identical rankings and -1 for reversed ones.
+    """
+    return spearmanRhoMany([b], a)[0]
+
+def spearmanRhoMany(rankings, reference):
+    """
+    Calculates the Spearman rank correlation of many rankings with one reference.
+
+    Returns:
+        A float array with the correlation of each ranking
+    """
+    positions = _referencePositions(rankings, reference)
+    n = len(reference)
+    if n < 2:
+        return np.ones(len(positions))
+    squares = ((positions - np.arange(n)) ** 2).sum(axis=1)
+    return 1.0 - 6.0 * squares / (n * (n * n - 1.0))
+
+def _topKPositions(rankings, reference, k):
+    # Positions within the top k of each ranking and of the reference, k for teams outside them.
+    # Columns are the teams of the reference followed by those only the rankings name
+    teams = list(reference)
+    known = set(teams)
+    for ranking in rankings:
+        for team in ranking[:k]:
+            if team not in known:
+                known.add(team)
+                teams.append(team)
+    positions = rankingPositions([ ranking[:k] for ranking in rankings ], teams)[:, :-1]
+    positions[positions < 0] = k
+    referencePositions = np.full(len(teams), k, dtype=np.int64)
+    referencePositions[:min(k, len(reference))] = np.arange(min(k, len(reference)))
+    return positions, referencePositions
+
+def topKFootrule(a, b, k):
+    """
+    Calculates the top-k footrule distance F^(k+1) of Fagin, Kumar and Sivakumar between the
+    top k teams of two rankings. Teams missing from one top k list are placed at position k.
+    """
+    return topKFootruleMany([b], a, k)[0]
+
+def topKFootruleMany(rankings, reference, k):
+    """
+    Calculates the top-k footrule distance F^(k+1) of many rankings to one reference.
+    The rankings do not need to hold the same teams.
+
+    Returns:
+        An integer array with the distance of each ranking
+    """
+    positions, referencePositions = _topKPositions(rankings, reference, k)
+    return np.abs(positions - referencePositions).sum(axis=1)
+
+def topKKendall(a, b, k, p=0.5):
+    """
+    Calculates the top-k Kendall distance K^(p) of Fagin, Kumar and Sivakumar between the top k
+    teams of two rankings. See topKKendallMany.
+    """
+    return topKKendallMany([b], a, k, p)[0]
+
+def topKKendallMany(rankings, reference, k, p=0.5, chunk=256):
+    """
+    Calculates the top-k Kendall distance K^(p) of many rankings to one reference. Over the
+    pairs of teams in the union of both top k lists, a pair costs 1 when the lists order it
+    differently, counting a listed team as ahead of an unlisted one, and p when both teams are
+    missing from one of the lists, which therefore says nothing about their order. With k at
+    least the number of teams and rankings that are permutations of the reference this is the
+    Kendall tau distance. Pairs are compared as arrays, O(R m^2) for m teams in total.
+
+    Args:
+        rankings (list): rankings as lists of team names, from high to low
+        reference (list): the reference ranking
+        k (int): the list length
+        p (float): the penalty for pairs whose order one list leaves open
+        chunk (int): the number of rankings compared together
+
+    Returns:
+        A float array with the distance of each ranking
+    """
+    positions, referencePositions = _topKPositions(rankings, reference, k)
+    upper = np.triu(np.ones((positions.shape[1], positions.shape[1]), dtype=bool), 1)
+    referenceOrder = np.sign(referencePositions[:, None] - referencePositions[None, :])
+    distances = np.zeros(len(positions))
+    for start in range(0, len(positions), chunk):
+        block = positions[start:start + chunk]
+        listed = (block < k) | (referencePositions < k)
+        inUnion = listed[:, :, None] & listed[:, None, :] & upper
+        product = np.sign(block[:, :, None] - block[:, None, :]) * referenceOrder
+        distances[start:start + chunk] = np.count_nonzero(inUnion & (product < 0), axis=(1, 2)) + \
+            p * np.count_nonzero(inUnion & (product == 0), axis=(1, 2))
+    return distances
+
 if __name__ == "__main__":
     rankingTest()
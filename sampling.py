@@ -0,0 +1,54 @@
+import numpy as np
+from scipy.stats import norm
+import instrument
+
+@instrument.timed('triads.sample')
+def estimate_totals(num_items,values,samples=None,rel_error=None,confidence=0.95,seed=None,batch=4096,min_samples=30):
+    """
+    Estimates column totals over a population of items from a simple random sample without replacement, e.g.
+    triad counts per type as the sum over edges of the triads each edge closes. Items are drawn in batches
+    until the sample budget is spent or every column total seen so far is known to the target relative error.
+
+    Args:
+        num_items (int): the size of the population
+        values (array -> array): maps an array of item indices to a (len(indices), columns) array of their values
+        samples (int): the most items to draw, the whole population if None
+        rel_error (float): stop once every nonzero estimate's confidence interval half width is at most
+            rel_error times the estimate. None draws exactly samples items
+        confidence (float): the level of the confidence intervals
+        seed (int): the seed of the item order, the same seed gives the same estimates
+        batch (int): the number of items drawn between stopping checks
+        min_samples (int): the fewest items drawn before rel_error can stop the sampling
+
+    Returns:
+        (totals, lower, upper, drawn) where totals are the estimates (num_items times the sample means),
+        lower and upper the normal approximation confidence bounds with the finite population correction,
+        and drawn the number of items sampled. When the whole population is drawn the totals are exact
+    """
+    if samples is None and rel_error is None:
+        raise ValueError("Give a sample budget, a target relative error or both")
+    budget=num_items if samples is None else min(int(samples),num_items)
+    z=norm.ppf(0.5+confidence/2.0)
+    order=np.random.RandomState(seed).permutation(num_items)
+    columns=np.shape(values(order[:0]))[1]
+    total=np.zeros(columns)
+    squares=np.zeros(columns)
+    drawn=0
+    while True:
+        size=min(batch,budget-drawn)
+        if size>0:
+            batch_values=np.asarray(values(order[drawn:drawn+size]),dtype=np.float64)
+            total+=batch_values.sum(axis=0)
+            squares+=(batch_values**2).sum(axis=0)
+            drawn+=size
+        mean=total/max(drawn,1)
+        variance=np.maximum(squares-total*mean,0)/max(drawn-1,1)
+        correction=1.0-drawn/float(num_items) if num_items else 0.0
+        half_width=z*num_items*np.sqrt(variance/max(drawn,1)*correction)
+        estimate=num_items*mean
+        if drawn>=budget:
+            break
+        seen=estimate>0
+        if rel_error is not None and drawn>=min_samples and np.all(half_width[seen]<=rel_error*estimate[seen]):
+            break
+    return estimate,np.maximum(estimate-half_width,0),estimate+half_width,drawn
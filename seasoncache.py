@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+CACHE_DIR = os.environ.get('SPORTSDATA_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'sportsdata'))
+CACHE_VERSION = 2
+COLUMNS = ['winner', 'loser', 'date', 'winnerScore', 'loserScore', 'tie']
+
+def seasonDirectory(league, year, kind):
+    """
+    Gives the directory a season is cached in
+
+    Args:
+        league (str): the league name, e.g. 'mlb'
+        year (int): the season
+        kind (str): the part of the season, e.g. 'REG'
+
+    Returns:
+        The path of the season's cache directory
+    """
+    return os.path.join(CACHE_DIR, '%s-%d-%s' % (league, year, kind))
+
+def sourceFingerprint(version, paths=(), volatile=None):
+    """
+    Summarizes the source of a season so a cached copy can be checked against it
+
+    Args:
+        version (str): the version of the package the games come from
+        paths (list): files or directories the package reads the games from, missing ones are skipped.
+            Directories are walked, and the path, modification time and size of every file under them
+            are summarized in a digest, so rewriting a nested file changes the fingerprint
+        volatile (str): extra state that changes while a season is still being played, e.g. today's date
+
+    Returns:
+        A JSON serializable fingerprint
+    """
+    stats = []
+    for path in paths:
+        if os.path.isdir(path):
+            digest = hashlib.sha1()
+            for root, directories, files in os.walk(path):
+                directories.sort()
+                for name in sorted(files):
+                    filePath = os.path.join(root, name)
+                    try:
+                        info = os.stat(filePath)
+                    except OSError:
+                        continue
+                    digest.update('%s\0%d\0%d\n' % (os.path.relpath(filePath, path), int(info.st_mtime), info.st_size))
+            stats.append([path, digest.hexdigest()])
+        elif os.path.exists(path):
+            info = os.stat(path)
+            stats.append([path, int(info.st_mtime), info.st_size])
+    return [CACHE_VERSION, str(version), stats, volatile]
+
+def loadSeason(league, year, kind, fingerprint):
+    """
+    Loads a cached season, with every column memory-mapped
+
+    Args:
+        league (str): the league name
+        year (int): the season
+        kind (str): the part of the season
+        fingerprint (list): the current fingerprint of the season's source, see sourceFingerprint
+
+    Returns:
+        A dictionary with the team names under 'teams' and an array for every name in COLUMNS,
+        or None if the season is not cached or the cached copy is stale
+    """
+    directory = seasonDirectory(league, year, kind)
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['fingerprint'] != json.loads(json.dumps(fingerprint)):
+            return None
+        season = { column : np.load(os.path.join(directory, column + '.npy'), mmap_mode='r') for column in COLUMNS }
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    season['teams'] = [ str(team) for team in meta['teams'] ]
+    return season
+
+def storeSeason(league, year, kind, fingerprint, teams, columns):
+    """
+    Writes a season to the cache. The files are written to a scratch directory first and moved into
+    place at once, so concurrent readers never see half a season
+
+    Args:
+        league (str): the league name
+        year (int): the season
+        kind (str): the part of the season
+        fingerprint (list): the fingerprint of the season's source
+        teams (list): the team names, winner and loser hold indices into this list
+        columns (dict): an array for every name in COLUMNS, one entry per game
+
+    Returns:
+        The stored season, loaded back as in loadSeason. The cache is best-effort: if it can't be
+        written, or another process stored a different copy first, the given columns are returned
+        from memory instead
+    """
+    directory = seasonDirectory(league, year, kind)
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            try:
+                os.makedirs(CACHE_DIR)
+            except OSError:
+                if not os.path.isdir(CACHE_DIR):
+                    raise
+        scratch = tempfile.mkdtemp(prefix='.tmp-', dir=CACHE_DIR)
+        try:
+            for column in COLUMNS:
+                np.save(os.path.join(scratch, column + '.npy'), columns[column])
+            with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+                json.dump({ 'league' : league, 'year' : year, 'kind' : kind,
+                    'fingerprint' : fingerprint, 'teams' : list(teams) }, f)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+            try:
+                os.rename(scratch, directory)
+            except OSError:
+                # Another process stored the season first
+                shutil.rmtree(scratch, ignore_errors=True)
+        except:
+            shutil.rmtree(scratch, ignore_errors=True)
+            raise
+    except (IOError, OSError):
+        return memorySeason(teams, columns)
+    season = loadSeason(league, year, kind, fingerprint)
+    if season is None:
+        return memorySeason(teams, columns)
+    return season
+
+def memorySeason(teams, columns):
+    """
+    Gives a season's columns in the form loadSeason returns, without the cache
+
+    Args:
+        teams (list): the team names, winner and loser hold indices into this list
+        columns (dict): an array for every name in COLUMNS, one entry per game
+
+    Returns:
+        A dictionary with the team names under 'teams' and the array of every name in COLUMNS
+    """
+    season = { column : columns[column] for column in COLUMNS }
+    season['teams'] = [ str(team) for team in teams ]
+    return season
+
+def buildColumns(games, teams=None):
+    """
+    Converts processed games into cache columns
+
+    Args:
+        games (list): (winner, loser, date, winnerScore, loserScore, tie) tuples, date as 'YYYY-MM-DD'
+        teams (list): the team names, by default the sorted names appearing in games
+
+    Returns:
+        (teams, columns) ready for storeSeason
+    """
+    if teams is None:
+        teams = sorted(set(game[0] for game in games) | set(game[1] for game in games))
+    index = { team : i for i, team in enumerate(teams) }
+    columns = {
+        'winner' : np.array([ index[game[0]] for game in games ], dtype=np.int16),
+        'loser' : np.array([ index[game[1]] for game in games ], dtype=np.int16),
+        'date' : np.array([ game[2] for game in games ], dtype='datetime64[D]'),
+        'winnerScore' : np.array([ game[3] for game in games ], dtype=np.int16),
+        'loserScore' : np.array([ game[4] for game in games ], dtype=np.int16),
+        'tie' : np.array([ game[5] for game in games ], dtype=bool),
+    }
+    return list(teams), columns
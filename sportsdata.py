@@ -1,8 +1,262 @@
+import os
+from datetime import date
+import numpy as np
 import mlbgame
 import nflgame
+import nflgame.version
+import seasoncache
+from gametable import GameTable
+import instrument
 
+# Processed seasons loaded in this process, by year. Each is a dictionary of columns as returned
+# by seasoncache.loadSeason
 mlbGames = {}
 nflGames = {}
+mlbTeams = {}
+
+def getMLBTeams():
+    """
+    Looks up the MLB teams once per process
+
+    Returns:
+        A dictionary of club common name -> upper case club abbreviation
+    """
+    if not mlbTeams:
+        mlbTeams.update({ team.club_common_name : team.club.upper() for team in mlbgame.teams() })
+    return mlbTeams
+
+def _volatile(year):
+    # Seasons that are not over yet can still gain games, so their cached copies expire daily
+    today = date.today()
+    return today.isoformat() if year >= today.year else None
+
+def mlbSeason(year, refresh=False):
+    """
+    Gives the processed games of an MLB season, from memory, the on-disk cache or mlbgame in that order.
+    Only games between two MLB teams with a winner are kept
+
+    The cached copy is checked against the files under mlbgame's local gameday-data folder. Versions of
+    mlbgame that fetch the games over HTTP have no such folder, so a finished season is only reparsed
+    when the mlbgame version changes; pass refresh to reparse it after the upstream data was corrected.
+    The refreshed season also replaces the copy getMLBGames and the other getters use
+
+    Args:
+        year (int): the season
+        refresh (bool): skip the memory and disk caches, reparse the season and cache it again
+
+    Returns:
+        A dictionary of columns as returned by seasoncache.loadSeason
+    """
+    if year in mlbGames and not refresh:
+        return mlbGames[year]
+    source = os.path.join(os.path.dirname(mlbgame.__file__), 'gameday-data', 'year_%d' % year)
+    fingerprint = seasoncache.sourceFingerprint(mlbgame.VERSION, [source], _volatile(year))
+    season = None if refresh else seasoncache.loadSeason('mlb', year, 'all', fingerprint)
+    instrument.count('load.cache_misses' if season is None else 'load.cache_hits')
+    if season is None:
+        columnTeams, columns = _parseMLBSeason(year)
+        season = seasoncache.storeSeason('mlb', year, 'all', fingerprint, columnTeams, columns)
+    mlbGames[year] = season
+    seasonMatrices.pop(('mlb', year), None)
+    return season
+
+@instrument.timed('load.parse_season')
+def _parseMLBSeason(year):
+    # Parses a season from mlbgame into cache columns
+    teams = getMLBTeams()
+    processedGames = []
+    for game in mlbgame.combine_games(mlbgame.games(year)):
+        try:
+            # Some game data is with teams not in the MLB, some games don't have winners, so check for that
+            if game.w_team in teams and game.l_team in teams:
+                if game.w_team == game.home_team:
+                    scores = (game.home_team_runs, game.away_team_runs)
+                else:
+                    scores = (game.away_team_runs, game.home_team_runs)
+                processedGames.append((teams[game.w_team], teams[game.l_team], game.date.strftime('%Y-%m-%d')) + scores + (False,))
+        except AttributeError:
+            pass
+    return seasoncache.buildColumns(processedGames, sorted(set(teams.values())))
+
+def nflSeason(year, refresh=False):
+    """
+    Gives the processed regular season games of an NFL season, from memory, the on-disk cache or
+    nflgame in that order. Ties are stored with the home team as winner and the tie flag set
+
+    Args:
+        year (int): the season
+        refresh (bool): skip the memory and disk caches, reparse the season and cache it again
+
+    Returns:
+        A dictionary of columns as returned by seasoncache.loadSeason
+    """
+    if year in nflGames and not refresh:
+        return nflGames[year]
+    package = os.path.dirname(nflgame.__file__)
+    sources = [os.path.join(package, 'schedule.json'), os.path.join(package, 'gamecenter-json')]
+    fingerprint = seasoncache.sourceFingerprint(nflgame.version.__version__, sources, _volatile(year))
+    season = None if refresh else seasoncache.loadSeason('nfl', year, 'REG', fingerprint)
+    instrument.count('load.cache_misses' if season is None else 'load.cache_hits')
+    if season is None:
+        columnTeams, columns = _parseNFLSeason(year)
+        season = seasoncache.storeSeason('nfl', year, 'REG', fingerprint, columnTeams, columns)
+    nflGames[year] = season
+    seasonMatrices.pop(('nfl', year), None)
+    return season
+
+@instrument.timed('load.parse_season')
+def _parseNFLSeason(year):
+    # Parses a regular season from nflgame into cache columns
+    processedGames = []
+    for game in nflgame.games(year, kind='REG'):
+        try:
+            winner, loser = str(game.winner), str(game.loser)
+            tie = winner == loser
+            if tie:
+                winner, loser = str(game.home), str(game.away)
+            day = '%s-%s-%s' % (game.eid[:4], game.eid[4:6], game.eid[6:8])
+            processedGames.append((winner, loser, day, max(game.score_home, game.score_away), min(game.score_home, game.score_away), tie))
+        except:
+            print "Error accessing data for game", game
+            pass
+    return seasoncache.buildColumns(processedGames)
+
+def seasonTable(season, year):
+    """
+    Wraps a processed season as a GameTable, without copying the team names
+
+    Args:
+        season (dict): a season as returned by mlbSeason or nflSeason
+        year (int): the season's year
+
+    Returns:
+        A gametable.GameTable of the season's games
+    """
+    return GameTable.from_columns(season['teams'], season['winner'], season['loser'], year, season['date'],
+        season['winnerScore'], season['loserScore'], season['tie'])
+
+def getMLBTable(start, end=None):
+    """
+    Gives the MLB games of the seasons between start and end as one GameTable
+
+    Args:
+        start (int): the first season
+        end (int): the last season, start if None
+
+    Returns:
+        A gametable.GameTable
+    """
+    end = start if end is None else end
+    return GameTable.concat([ seasonTable(mlbSeason(year), year) for year in range(start, end + 1) ])
+
+def getNFLTable(start, end=None):
+    """
+    Gives the NFL regular season games of the seasons between start and end as one GameTable,
+    ties included with their tie flag set
+
+    Args:
+        start (int): the first season
+        end (int): the last season, start if None
+
+    Returns:
+        A gametable.GameTable
+    """
+    end = start if end is None else end
+    return GameTable.concat([ seasonTable(nflSeason(year), year) for year in range(start, end + 1) ])
+
+# Win/loss spread matrices of single seasons, by (league, year), see seasonSpreads
+seasonMatrices = {}
+
+def _leagueSeason(league, year):
+    return mlbSeason(year) if league == 'mlb' else nflSeason(year)
+
+def _leagueTeams(league):
+    # The team lists getMLBEdges and getNFLEdges have always returned
+    if league == 'mlb':
+        return getMLBTeams().values()
+    return [ team[0] for team in nflgame.teams ]
+
+def seasonSpreads(league, year):
+    """
+    Gives the win/loss spread matrix of one season, computed once per process. Ties are skipped
+
+    Args:
+        league (str): 'mlb' or 'nfl'
+        year (int): the season
+
+    Returns:
+        (teams, spreads, played) where spreads[i, j] is the number of wins of teams[i] against
+        teams[j] minus its losses, and played[i, j] is True if the two teams played a game that
+        was not a tie
+    """
+    key = (league, year)
+    if key not in seasonMatrices:
+        season = _leagueSeason(league, year)
+        n = len(season['teams'])
+        decided = ~np.asarray(season['tie'])
+        winner = np.asarray(season['winner'])[decided].astype(np.int64)
+        loser = np.asarray(season['loser'])[decided].astype(np.int64)
+        wins = np.bincount(winner * n + loser, minlength=n * n).reshape(n, n).astype(np.float64)
+        seasonMatrices[key] = (season['teams'], wins - wins.T, (wins + wins.T) > 0)
+    return seasonMatrices[key]
+
+def discountedSpreads(league, start, end, gammas=0.8):
+    """
+    Sums the season spread matrices between start and end, each season discounted by
+    gamma**(end - year). A list of gammas is done in one weighted sum over the stacked seasons
+
+    Args:
+        league (str): 'mlb' or 'nfl'
+        start (int): the first season
+        end (int): the last season
+        gammas (float or list): the discount factor, or several of them
+
+    Returns:
+        (teams, spreads, played) where teams are the sorted names of every season's teams, spreads
+        is a team x team matrix (a gamma x team x team tensor for a list of gammas) and played marks
+        the pairs that played a game that was not a tie in any of the seasons
+    """
+    seasons = [ seasonSpreads(league, year) for year in range(start, end + 1) ]
+    teams = sorted(set(team for season in seasons for team in season[0]))
+    index = { team : i for i, team in enumerate(teams) }
+    n = len(teams)
+    stacked = np.zeros((len(seasons), n, n))
+    played = np.zeros((n, n), dtype=bool)
+    for s, (names, spreads, seasonPlayed) in enumerate(seasons):
+        # Team lists can differ between seasons, so each season is placed into the union
+        ids = np.ix_(*[ np.array([ index[name] for name in names ], dtype=np.int64) ] * 2)
+        stacked[s][ids] = spreads
+        played[ids] |= seasonPlayed
+    exponents = float(end) - np.arange(start, end + 1)
+    weights = np.power(np.array(gammas, dtype=np.float64).reshape(-1, 1), exponents)
+    tensor = np.tensordot(weights, stacked, axes=1)
+    return teams, (tensor if np.ndim(gammas) else tensor[0]), played
+
+def spreadEdges(teams, spreads, played):
+    """
+    Converts a spread matrix into the dictionary of (team1, team2) -> wl_spread that
+    getMLBEdges returns, with an entry for every pair that played even if its spread is 0
+    """
+    first, second = np.nonzero(played)
+    names = np.array(teams, dtype=object)
+    return dict(zip(zip(names[first].tolist(), names[second].tolist()), spreads[first, second].tolist()))
+
+def getEdgeBatch(league, start, end, gammas):
+    """
+    getMLBEdges or getNFLEdges for several gammas at once, sharing the season matrices
+
+    Args:
+        league (str): 'mlb' or 'nfl'
+        start (int): the first season to gather data for
+        end (int): the last season to collect data for
+        gammas (list): the discount factors
+
+    Returns:
+        A list with the (teams, edges) of each gamma
+    """
+    teams, spreads, played = discountedSpreads(league, start, end, list(gammas))
+    leagueTeams = _leagueTeams(league)
+    return [ (leagueTeams, spreadEdges(teams, spread, played)) for spread in spreads ]
 
 def getMLBEdges(start, end, gamma=0.8):
     """
@@ -19,53 +273,20 @@ def getMLBEdges(start, end, gamma=0.8):
     Returns:
         A dictionary of edges to win/loss spreads
     """
-
-    edges = {}
-    teams = { team.club_common_name : team.club.upper() for team in mlbgame.teams() }
-    for year in range(start, end + 1):
-        if year not in mlbGames:
-            games = mlbgame.combine_games(mlbgame.games(year))
-            mlbGames[year] = games
-        else:
-            games = mlbGames[year]
-        discount = gamma**(end - year)
-        for game in games:
-            try:
-                # Some game data is with teams not in the MLB, some games don't have winners, so check for that
-                if game.w_team in teams and game.l_team in teams:
-                    winner = teams[game.w_team]
-                    loser = teams[game.l_team]
-                    edges[(winner, loser)] = edges.get((winner, loser), 0.0) + 1 * discount
-                    edges[(loser, winner)] = edges.get((loser, winner), 0.0) - 1 * discount
-            except AttributeError:
-                pass
-        
-    return teams.values(), edges
+    return getEdgeBatch('mlb', start, end, [ gamma ])[0]
 
 def getMLBGames(year):
-    teams = { team.club_common_name : team.club.upper() for team in mlbgame.teams() }
-    if year not in mlbGames:
-        games = mlbgame.combine_games(mlbgame.games(year))
-        mlbGames[year] = games
-    else:
-        games = mlbGames[year]
-    processedGames = []
-    for game in games:
-        try:
-            if game.w_team in teams and game.l_team in teams:
-                winner = teams[game.w_team]
-                loser = teams[game.l_team]
-                processedGames.append((winner, loser))
-        except:
-            pass
-    return processedGames
+    season = mlbSeason(year)
+    teams = season['teams']
+    return [ (teams[winner], teams[loser]) for winner, loser in zip(season['winner'].tolist(), season['loser'].tolist()) ]
 
 def getNFLEdges(start, end, gamma=0.8):
     """
     Generates a dictionary of (team1, team2) -> wl_spread where
     wl_spread is the sum of discounted win-loss spreads of seasons
     between start and end. Win-loss spreads are calculated as the number
-    of wins team1 has against team2 minus the number of losses
+    of wins team1 has against team2 minus the number of losses.
+    Ties are ignored
 
     Args:
         start (int): the first season to gather data for
@@ -75,35 +296,18 @@ def getNFLEdges(start, end, gamma=0.8):
     Returns:
         A dictionary of edges to win/loss spreads
     """
-
-    edges = {}
-    teams = [ team[0] for team in nflgame.teams ]
-    for year in range(start, end + 1):
-        if year not in nflGames:
-            games = nflgame.games(year, kind='REG')
-            nflGames[year] = games
-        else:
-            games = nflGames[year]
-        discount = gamma**(end - year)
-        for game in games:
-            try:
-                winner = str(game.winner)
-                loser = str(game.loser)
-                if winner != loser:
-                # Ignore tie games
-                    edges[(winner, loser)] = edges.get((winner, loser), 0.0) + 1 * discount
-                    edges[(loser, winner)] = edges.get((loser, winner), 0.0) - 1 * discount
-            except:
-                print "Error accessing data for game", game
-                pass
-        
-    return teams, edges
+    return getEdgeBatch('nfl', start, end, [ gamma ])[0]
 
 def getNFLGames(year):
-    if year not in nflGames:
-        games = nflgame.games(year, kind='REG')
-        nflGames[year] = games
-    else:
-        games = nflGames[year]
-    return [(str(game.winner), str(game.loser)) for game in games]
+    season = nflSeason(year)
+    teams = season['teams']
+    games = []
+    for winner, loser, tie in zip(season['winner'].tolist(), season['loser'].tolist(), season['tie'].tolist()):
+        if tie:
+            # nflgame names both sides of a tie home/away
+            name = '%s/%s' % (teams[winner], teams[loser])
+            games.append((name, name))
+        else:
+            games.append((teams[winner], teams[loser]))
+    return games
 
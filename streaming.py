@@ -0,0 +1,295 @@
+import random
+import numpy as np
+import centrality
+import instrument
+from gametable import GameTable
+from ranking import degreeDifference, edgeWeightDifference, randomValue, ARRAY_KEYS
+
+# Above one changed team in REBUILD_SHARE the whole partition tree is rebuilt instead of updated
+REBUILD_SHARE = 8
+
+class StreamingRanker(object):
+    """
+    Keeps a ranking, HITS and PageRank of a season up to date as games come in.
+
+    Games are folded into win/loss spreads per pair of teams, as in sportsdata.getMLBEdges, and
+    the graph has an edge from the loser to the winner of every pair with a positive spread,
+    weighted by the spread. The leader/follower partitions of ranking.ranking are cached as a
+    tree; after new games only the partitions holding a changed pair, or whose members or
+    incoming order changed, are sorted again, and every other subtree is reused as is. HITS
+    and PageRank warm start from the previous scores, so a game day converges in a few
+    iterations.
+
+    With degreeDifference and edgeWeightDifference keys the ranking is the one
+    ranking.rankingArrays gives on edgeArrays. randomValue keys are drawn once per team when it
+    is added, rather than on every ranking, so that rankings do not change between game days
+    without a reason.
+    """
+
+    def __init__(self, teams=(), alpha=0.6, primary=degreeDifference, secondary=edgeWeightDifference,
+                 beta=0.85, tol=1e-8):
+        """
+        Args:
+            teams (list): team names known up front, so they are ranked before they play
+            alpha (float): the relative size of the leader partition
+            primary: degreeDifference, edgeWeightDifference or randomValue
+            secondary: degreeDifference, edgeWeightDifference or randomValue
+            beta (float): 1 minus the PageRank teleport probability
+            tol (float): the convergence tolerance of HITS and PageRank
+        """
+        self.alpha = alpha
+        self.keys = (ARRAY_KEYS[primary], ARRAY_KEYS[secondary])
+        self.beta = beta
+        self.tol = tol
+        self.teams = []
+        self.index = {}
+        self.draws = np.zeros(0)
+        # One slot per pair of teams (first < second) that has played, with the spread of first over second
+        self.pairs = {}
+        self.first = np.zeros(0, dtype=np.int64)
+        self.second = np.zeros(0, dtype=np.int64)
+        self.spreads = np.zeros(0)
+        self.numPairs = 0
+        self.changed = set()
+        self.tree = None
+        self.order = None
+        self.hitsVectors = None
+        self.pageranks = None
+        self.hitsStale = True
+        self.pagerankStale = True
+        for team in teams:
+            self._teamId(team)
+
+    def _teamId(self, team):
+        if team not in self.index:
+            self.index[team] = len(self.teams)
+            self.teams.append(team)
+            self.draws = np.append(self.draws, random.random())
+        return self.index[team]
+
+    def _pairSlot(self, first, second):
+        key = (first, second)
+        if key not in self.pairs:
+            if self.numPairs == len(self.spreads):
+                size = max(2 * self.numPairs, 16)
+                self.first = np.resize(self.first, size)
+                self.second = np.resize(self.second, size)
+                self.spreads = np.resize(self.spreads, size)
+            self.pairs[key] = self.numPairs
+            self.first[self.numPairs] = first
+            self.second[self.numPairs] = second
+            self.spreads[self.numPairs] = 0.0
+            self.numPairs += 1
+        return self.pairs[key]
+
+    def addGames(self, games):
+        """
+        Adds finished games and returns the updated ranking
+
+        Args:
+            games (list): (winner, loser) name pairs, or a gametable.GameTable whose ties are skipped
+
+        Returns:
+            The team names in descending order by ranking, see ranking
+        """
+        if isinstance(games, GameTable):
+            games = games.select(~games.games['tie']).pairs()
+        added = False
+        for winner, loser in games:
+            winnerId = self._teamId(winner)
+            loserId = self._teamId(loser)
+            if winnerId == loserId:
+                continue
+            if winnerId < loserId:
+                slot = self._pairSlot(winnerId, loserId)
+                self.spreads[slot] += 1
+            else:
+                slot = self._pairSlot(loserId, winnerId)
+                self.spreads[slot] -= 1
+            self.changed.add(slot)
+            added = True
+        if added:
+            self.hitsStale = True
+            self.pagerankStale = True
+        return self.ranking()
+
+    def addGame(self, winner, loser):
+        """
+        Adds one finished game and returns the updated ranking, see addGames
+        """
+        return self.addGames([ (winner, loser) ])
+
+    def edgeArrays(self):
+        """
+        Gives the current graph as the arrays ranking.rankingArrays and centrality take
+
+        Returns:
+            (src, dst, weights) with an edge from the loser to the winner of every pair with a
+            positive spread, weighted by the spread
+        """
+        spreads = self.spreads[:self.numPairs]
+        first = self.first[:self.numPairs]
+        second = self.second[:self.numPairs]
+        decided = spreads != 0
+        won = spreads[decided] > 0
+        src = np.where(won, second[decided], first[decided])
+        dst = np.where(won, first[decided], second[decided])
+        return src, dst, np.abs(spreads[decided])
+
+    @instrument.timed('streaming.rank')
+    def ranking(self):
+        """
+        Gives the ranking of all teams, re-sorting only the partitions the games since the last
+        call touched
+
+        Returns:
+            The team names in descending order by ranking
+        """
+        numNodes = len(self.teams)
+        if self.order is None or self.changed or len(self.order) != numNodes:
+            slots = np.array(sorted(self.changed), dtype=np.int64)
+            changed = (self.first[slots], self.second[slots])
+            src, dst, weights = self.edgeArrays()
+            touched = len(np.union1d(changed[0], changed[1]))
+            if self.tree is None or len(self.tree[0]) != numNodes or touched * REBUILD_SHARE > numNodes:
+                # Most partitions would be sorted again, which is cheaper a level at a time
+                self.tree = self._rebuild(numNodes, src, dst, weights)
+            else:
+                member = np.zeros(numNodes, dtype=bool)
+                local = np.zeros(numNodes, dtype=np.int64)
+                self.tree = self._rankPartition(np.arange(numNodes), src, dst, weights, self.tree, changed, member, local)
+            self.order = self.tree[1]
+            self.changed = set()
+        return [ self.teams[i] for i in self.order ]
+
+    def _rankPartition(self, nodes, src, dst, weights, cached, changed, member, local):
+        """
+        Ranks one partition, given in the order its parent sorted it, and its subtree
+
+        Args:
+            nodes (array): the partition's nodes
+            src, dst, weights (array): edges that include every edge inside the partition
+            cached (tuple): the partition's previous (nodes, order, leader, follower) tree, or None
+            changed (tuple): the (first, second) arrays of pairs whose spread changed
+            member (array): scratch mask over all nodes, all False
+            local (array): scratch index over all nodes
+
+        Returns:
+            The (nodes, order, leader, follower) tree of the partition
+        """
+        member[nodes] = True
+        if cached is not None and len(cached[0]) == len(nodes) and np.array_equal(cached[0], nodes) \
+                and not np.any(member[changed[0]] & member[changed[1]]):
+            member[nodes] = False
+            return cached
+        inside = member[src] & member[dst]
+        member[nodes] = False
+        src, dst, weights = src[inside], dst[inside], weights[inside]
+
+        local[nodes] = np.arange(len(nodes))
+        values = self._keyValues(nodes, src, dst, weights, local, len(nodes))
+        # Stable, so ties keep the parent's order as in ranking.rankingArrays
+        order = nodes[np.lexsort((-values[1], -values[0]))]
+
+        split = int(self.alpha * len(nodes))
+        if split == 0 or split == len(nodes):
+            return (nodes, order, None, None)
+        leader = self._rankPartition(order[:split], src, dst, weights, cached and cached[2], changed, member, local)
+        follower = self._rankPartition(order[split:], src, dst, weights, cached and cached[3], changed, member, local)
+        return (nodes, np.concatenate((leader[1], follower[1])), leader, follower)
+
+    def _keyValues(self, nodes, src, dst, weights, local, size):
+        # The primary and secondary key of every node, over the given edges, indexed by local[node]
+        values = []
+        for key in self.keys:
+            if key == 'degree':
+                values.append(np.bincount(local[dst], minlength=size) - np.bincount(local[src], minlength=size))
+            elif key == 'weight':
+                values.append(np.bincount(local[dst], weights, minlength=size) - np.bincount(local[src], weights, minlength=size))
+            else:
+                values.append(self.draws[nodes])
+        return values
+
+    def _rebuild(self, numNodes, src, dst, weights):
+        """
+        Ranks all teams from scratch a level at a time, as ranking.rankingArrays does, and
+        returns the partition tree _rankPartition keeps up to date
+        """
+        order = np.arange(numNodes)
+        segment = np.full(numNodes, -1, dtype=np.int64)
+        starts = np.array([0], dtype=np.int64)
+        ends = np.array([numNodes], dtype=np.int64)
+        levels = []
+        while len(starts) > 0:
+            sizes = ends - starts
+            segmentIndex = np.repeat(np.arange(len(starts)), sizes)
+            positions = np.repeat(starts, sizes) + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            nodes = order[positions]
+            segment[:] = -1
+            segment[nodes] = segmentIndex
+            inside = segment[src] == segment[dst]
+            values = self._keyValues(nodes, src[inside], dst[inside], weights[inside], np.arange(numNodes), numNodes)
+            values = [ value if key == 'random' else value[nodes] for key, value in zip(self.keys, values) ]
+            order[positions] = nodes[np.lexsort((-values[1], -values[0], segmentIndex))]
+
+            splits = (self.alpha * sizes).astype(np.int64)
+            recurse = (splits > 0) & (sizes - splits > 0)
+            levels.append((starts, ends, nodes, np.cumsum(sizes) - sizes, recurse))
+            leaderEnds = starts[recurse] + splits[recurse]
+            starts, ends = np.concatenate((starts[recurse], leaderEnds)), np.concatenate((leaderEnds, ends[recurse]))
+
+        # Partitions are contiguous ranges of the final order, and the children of the r-th
+        # partition that split are the r-th leader and follower of the next level
+        children = None
+        for starts, ends, nodes, offsets, recurse in reversed(levels):
+            numSplit = np.count_nonzero(recurse)
+            splitIndex = np.cumsum(recurse) - 1
+            trees = []
+            for i in range(len(starts)):
+                incoming = nodes[offsets[i]:offsets[i] + ends[i] - starts[i]]
+                if recurse[i]:
+                    trees.append((incoming, order[starts[i]:ends[i]], children[splitIndex[i]], children[numSplit + splitIndex[i]]))
+                else:
+                    trees.append((incoming, order[starts[i]:ends[i]], None, None))
+            children = trees
+        return children[0]
+
+    def hits(self):
+        """
+        Gives HITS scores of the current graph, warm started from the previous ones (see centrality.hits)
+
+        Returns:
+            (hubs, authorities) arrays with the unit length scores of teams[i] at index i
+        """
+        if self.hitsStale or self.hitsVectors is None:
+            src, dst, weights = self.edgeArrays()
+            start = (None, None)
+            if self.hitsVectors is not None and self.hitsVectors[1].any():
+                start = tuple(self._extend(vector) for vector in self.hitsVectors)
+            hubs, authorities, iterations = centrality.hits(len(self.teams), src, dst, weights, tol=self.tol,
+                                                            hubs=start[0], authorities=start[1])
+            self.hitsVectors = (hubs, authorities)
+            self.hitsStale = False
+        return self.hitsVectors
+
+    def pagerank(self):
+        """
+        Gives the PageRank of the current graph, warm started from the previous ranks (see centrality.pagerank)
+
+        Returns:
+            An array with the rank of teams[i] at index i, summing to 1
+        """
+        if self.pagerankStale or self.pageranks is None:
+            src, dst, weights = self.edgeArrays()
+            start = None if self.pageranks is None else self._extend(self.pageranks)
+            self.pageranks, iterations = centrality.pagerank(len(self.teams), src, dst, weights, beta=self.beta,
+                                                             tol=self.tol, start=start)
+            self.pagerankStale = False
+        return self.pageranks
+
+    def _extend(self, vector):
+        # Teams added since the scores were computed start at the mean score
+        if len(vector) == len(self.teams):
+            return vector
+        mean = vector.mean() if len(vector) else 1.0
+        return np.concatenate((vector, np.full(len(self.teams) - len(vector), mean)))
@@ -1,33 +1,220 @@
-import snap
 import random
+import snap
+import numpy as np
+from gametable import GameTable, GAME_DTYPE, MISSING
+
+def makeRng(seed=None):
+    """
+    Creates the random generator used by the synthetic generators: numpy.random.default_rng
+    when NumPy has the Generator API and a RandomState otherwise. Callers only use methods
+    both provide (uniform, permutation, poisson and normal).
+
+    Args:
+        seed (object): a seed, or an existing generator which is returned as is. None seeds the
+            generator from the random module, so random.seed still makes the draws reproducible
+    """
+    if hasattr(seed, 'uniform') and hasattr(seed, 'permutation'):
+        return seed
+    if seed is None:
+        seed = random.getrandbits(32)
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+def initialStrengths(numNodes):
+    """
+    Gives the starting strengths 1 - i / numNodes, so node i is stronger than node j when i < j
+    """
+    return 1.0 - np.arange(numNodes, dtype=np.float64) / max(numNodes, 1)
+
+def _divisionPairs(division, rng):
+    """
+    Pairs teams within their divisions at random: teams are shuffled within each division and
+    neighbours in that order play. Odd teams out sit the round out.
+
+    Returns:
+        (first, second) id arrays of the pairs
+    """
+    order = np.argsort(division + rng.uniform(size=len(division)), kind='mergesort')
+    half = len(order) // 2
+    first, second = order[0:2 * half:2], order[1:2 * half:2]
+    same = division[first] == division[second]
+    return first[same], second[same]
+
+def _rounds(numNodes, gamesPerTeam, divisions, divisionShare):
+    """
+    The round types of a sparse season: True for divisional rounds, which come first
+    """
+    divisionRounds = int(round(divisionShare * gamesPerTeam)) if divisions > 1 else 0
+    return [ True ] * divisionRounds + [ False ] * (gamesPerTeam - divisionRounds)
+
+def syntheticGameCount(numNodes, gamesPerTeam=None, divisions=1, divisionShare=0.5, seasons=1):
+    """
+    Counts the games syntheticGames generates for the same arguments, without generating them
+    """
+    if gamesPerTeam is None:
+        return seasons * (numNodes * (numNodes - 1) // 2)
+    division = np.sort(np.arange(numNodes) % divisions)
+    half = numNodes // 2
+    perDivisionRound = int(np.count_nonzero(division[0:2 * half:2] == division[1:2 * half:2]))
+    perSeason = sum(perDivisionRound if divisional else half for divisional in _rounds(numNodes, gamesPerTeam, divisions, divisionShare))
+    return seasons * perSeason
+
+def syntheticGames(numNodes, alpha=0.3, gamesPerTeam=None, divisions=1, divisionShare=0.5, margin=0.0,
+                   seasons=1, drift=0.0, seed=None, chunkSize=1 << 20):
+    """
+    Generates synthetic games in chunks. Every team has a strength (see initialStrengths) and
+    in each game the stronger team wins with probability 1 - alpha. The full round robin
+    reproduces generateSyntheticGraph; sparse schedules scale to millions of teams.
+
+    Args:
+        numNodes (int): the number of teams, with ids 0, ..., numNodes - 1
+        alpha (float): the probability of an upset
+        gamesPerTeam (int): the number of rounds per season, each pairing every team with a
+            random opponent once. None plays a full round robin instead
+        divisions (int): the number of divisions, team i plays in division i % divisions
+        divisionShare (float): the share of rounds played within divisions
+        margin (float): the winning margin is 1 plus a Poisson draw with mean margin times the
+            strength gap, so 0 gives margin 1 everywhere
+        seasons (int): the number of seasons
+        drift (float): the standard deviation of the normal change of every strength between seasons
+        seed (object): a seed or generator for makeRng
+        chunkSize (int): the rough number of games per chunk
+
+    Yields:
+        Arrays of gametable.GAME_DTYPE games with the season index, winner, loser and margin set
+    """
+    rng = makeRng(seed)
+    strengths = initialStrengths(numNodes)
+    division = np.arange(numNodes) % max(divisions, 1)
+    for season in range(seasons):
+        if season > 0 and drift > 0:
+            strengths = strengths + rng.normal(0.0, drift, size=numNodes)
+        for first, second in _schedule(numNodes, gamesPerTeam, divisions, divisionShare, division, rng, chunkSize):
+            yield _play(first, second, strengths, alpha, margin, season, rng)
+
+def _schedule(numNodes, gamesPerTeam, divisions, divisionShare, division, rng, chunkSize):
+    """
+    Yields (first, second) id arrays of the pairs of one season, about chunkSize at a time
+    """
+    if gamesPerTeam is None:
+        # Rows i of the upper triangle, cut into blocks of about chunkSize pairs
+        start = 0
+        while start < numNodes - 1:
+            end = start + 1
+            count = numNodes - 1 - start
+            while end < numNodes - 1 and count + numNodes - 1 - end <= chunkSize:
+                count += numNodes - 1 - end
+                end += 1
+            rows = np.arange(start, end)
+            lengths = numNodes - 1 - rows
+            first = np.repeat(rows, lengths)
+            offsets = np.arange(len(first)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            yield first, first + 1 + offsets
+            start = end
+        return
+    pending = []
+    size = 0
+    for divisional in _rounds(numNodes, gamesPerTeam, divisions, divisionShare):
+        if divisional:
+            pair = _divisionPairs(division, rng)
+        else:
+            order = rng.permutation(numNodes)
+            half = numNodes // 2
+            pair = (order[0:2 * half:2], order[1:2 * half:2])
+        pending.append(pair)
+        size += len(pair[0])
+        if size >= chunkSize:
+            yield np.concatenate([ p[0] for p in pending ]), np.concatenate([ p[1] for p in pending ])
+            pending = []
+            size = 0
+    if pending:
+        yield np.concatenate([ p[0] for p in pending ]), np.concatenate([ p[1] for p in pending ])
+
+def _play(first, second, strengths, alpha, margin, season, rng):
+    """
+    Decides the games between first and second, returning them as GAME_DTYPE rows
+    """
+    games = np.zeros(len(first), dtype=GAME_DTYPE)
+    favourite = np.where(strengths[first] >= strengths[second], first, second)
+    underdog = np.where(strengths[first] >= strengths[second], second, first)
+    upset = rng.uniform(size=len(first)) < alpha
+    games['winner'] = np.where(upset, underdog, favourite)
+    games['loser'] = np.where(upset, favourite, underdog)
+    games['season'] = season
+    games['date'] = np.datetime64('NaT')
+    games['winner_score'] = MISSING
+    games['loser_score'] = MISSING
+    games['margin'] = 1
+    if margin > 0:
+        games['margin'] += rng.poisson(margin * (strengths[favourite] - strengths[underdog]))
+    return games
+
+def syntheticEdges(numNodes, **kwargs):
+    """
+    Generates synthetic games as edge arrays, with the arguments of syntheticGames
+
+    Returns:
+        (src, dst, margins) where each edge points from the loser to the winner
+    """
+    games = np.concatenate(list(syntheticGames(numNodes, **kwargs)) + [ np.zeros(0, dtype=GAME_DTYPE) ])
+    return games['loser'].astype(np.int64), games['winner'].astype(np.int64), games['margin'].astype(np.int64)
+
+def syntheticTable(numNodes, **kwargs):
+    """
+    Generates synthetic games as a gametable.GameTable whose teams are the ids 0, ..., numNodes - 1,
+    with the arguments of syntheticGames
+    """
+    games = np.concatenate(list(syntheticGames(numNodes, **kwargs)) + [ np.zeros(0, dtype=GAME_DTYPE) ])
+    return GameTable(range(numNodes), games)
+
+def writeSyntheticGames(path, numNodes, **kwargs):
+    """
+    Streams synthetic games to a .npy file of gametable.GAME_DTYPE rows, one chunk at a time,
+    so graphs larger than memory can be generated. Read them back with numpy.load(path, mmap_mode='r').
+
+    Args:
+        path (str): the file to write
+        numNodes (int): the number of teams
+        kwargs: the other arguments of syntheticGames
+
+    Returns:
+        The number of games written
+    """
+    count = syntheticGameCount(numNodes, kwargs.get('gamesPerTeam'), kwargs.get('divisions', 1),
+                               kwargs.get('divisionShare', 0.5), kwargs.get('seasons', 1))
+    output = np.lib.format.open_memmap(path, mode='w+', dtype=GAME_DTYPE, shape=(count,))
+    position = 0
+    for chunk in syntheticGames(numNodes, **kwargs):
+        output[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    output.flush()
+    del output
+    return position
 
 def generateSyntheticGraph(numNodes, alpha = 0.3, seed = None):
     """
     Generates a directed tournament graph with nodes 0, ..., numNodes - 1
-    where an edge points from node i to node j if i < j with probability 1 - alpha
-    and in the other direction with probability alpha
+    where an edge points from node j to node i if i < j with probability 1 - alpha
+    and in the other direction with probability alpha, i.e. from the loser to the
+    winner of a round robin (see syntheticGames)
 
     Args:
         numNodes (int): the number of nodes in the graph
         alpha (float): the probability that an edge flips its direction
-        seed (object): a seed for random
-    
+        seed (object): a seed for makeRng. None follows random.seed, as before. The draws now come
+            from NumPy, so a given seed no longer reproduces the graph earlier versions generated
+
     Returns:
         graph (snap.TNGraph): the generated graph
     """
 
-    if seed is not None:
-        random.seed(seed)
-
     graph = snap.TNGraph.New()
     for i in range(numNodes):
         graph.AddNode(i)
 
-    for i in range(numNodes):
-        for j in range(i + 1, numNodes):
-            if random.random() < alpha:
-                graph.AddEdge(i, j)
-            else:
-                graph.AddEdge(j, i)
+    for games in syntheticGames(numNodes, alpha, seed=seed):
+        for src, dst in zip(games['loser'].tolist(), games['winner'].tolist()):
+            graph.AddEdge(src, dst)
 
     return graph
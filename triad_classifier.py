@@ -1,6 +1,12 @@
 import build_graph
+from folds import run_folds
 from sklearn.linear_model import LogisticRegression
 import numpy as np
+import random
+import instrument
+
+#Feature rows of the four partial triad types, in the column order of build_graph.Graph.pair_partial_triads
+PARTIAL_TRIAD_ROWS=np.array([[0,0],[0,1],[1,0],[1,1]])
 
 class TriadClassifier:    
     def __init__(self,graph,weighted=False):
@@ -10,46 +16,73 @@ class TriadClassifier:
         if not weighted:
             self.attrs,self.labels,self.weights=(self.graph.get_unweighted_attrs_and_labels())
         else:
-            print "NOT CREATED YET"
-            exit(1)
+            #One row per edge with the counts and margin sums of its partial triads, see Graph.get_weighted_attrs_and_labels
+            self.attrs,self.labels,self.weights=(self.graph.get_weighted_attrs_and_labels())
 
     def train(self):
         self.model=LogisticRegression(solver='newton-cg')
-        self.model.fit(self.attrs,self.labels,self.weights)
+        with instrument.span('triads.fit'):
+            self.model.fit(self.attrs,self.labels,self.weights)
 
     def classify_pair(self,node1, node2):
-        attrs=np.array(self.graph.get_unweighted_partial_triads(node1,node2))        
-        attrs=np.multiply(attrs,1)
-        print attrs.shape
-        probs=self.model.predict_log_proba(attrs)
-        probs=np.exp(np.sum(probs,axis=0))
-        return np.divide(probs,sum(probs))
-        
-    def k_folds(self,k=4):
-        tp=0
-        fp=0
-        tn=0
-        fn=0
-        (graphs,test_edge_list)=self.graph.k_folds(k)
-        for graph,test_edges in zip(graphs,test_edge_list):
-            tc=TriadClassifier(graph)
-            tc.train()
-            for test in test_edges:
-                node1=test[0][0]
-                node2=test[0][1]
-                weight=test[1]
-                pred=tc.classify_pair(node1,node2)
-                if 1*weight>=0:
-                    if pred[0]>pred[1]:
-                        tp+=1
-                    else:
-                        fn+=1
-                else:
-                    if pred[0]<pred[1]:
-                        tn+=1
-                    else:
-                        fp+=1
-        return (tp,tn,fp,fn)
+        return self.classify_pairs([node1],[node2])[0]
+
+    #Class probabilities of many pairs at once, one row per (node1s[i], node2s[i]) as classify_pair gives them.
+    #A pair's log probabilities are summed over its partial triads, which take one of four sign pairs, so the sums
+    #for all pairs are the per-type counts of Graph.pair_partial_triads times the four types' log probabilities.
+    #Pairs without partial triads get [0.5, 0.5]. In weighted mode every pair is a single row of counts and margin
+    #sums, scored directly
+    def classify_pairs(self,node1s,node2s):
+        index=self.graph.edge_arrays()[5]
+        return self.classify_ids(np.array([index[node] for node in node1s],dtype=np.int64),
+                                 np.array([index[node] for node in node2s],dtype=np.int64))
+
+    #classify_pairs for arrays of node ids
+    def classify_ids(self,u,v):
+        if self.weighted:
+            attrs=self.graph.pair_partial_triads_ids(u,v,weighted=True)
+            probs=self.model.predict_proba(attrs)
+            probs[~attrs[:,:4].any(axis=1)]=0.5
+            return probs
+        counts=self.graph.pair_partial_triads_ids(u,v)
+        log_probs=counts.dot(self.model.predict_log_proba(PARTIAL_TRIAD_ROWS))
+        #Normalizing in log space, so pairs with many triads do not underflow to 0/0
+        probs=np.exp(log_probs-log_probs.max(axis=1)[:,None])
+        return probs/probs.sum(axis=1)[:,None]
+
+    #Returns (tp,tn,fp,fn) over k folds. workers>1 evaluates the folds in a process pool, seed fixes the
+    #per-fold seeds (drawn from random when not given) so the counts do not depend on workers
+    @instrument.timed('eval.triad_k_folds')
+    def k_folds(self,k=4,workers=1,seed=None):
+        order=self.graph.shuffled_order()
+        if seed is None:
+            seed=random.randint(0,2**30)
+        counts=run_folds(_eval_fold,_init_fold_worker,(self.graph,order,k,seed,self.weighted),k,workers)
+        return tuple(sum(fold[i] for fold in counts) for i in range(4))
+
+#Set in each worker process once by _init_fold_worker, so tasks only carry a fold index
+_fold_state=None
+
+def _init_fold_worker(state):
+    global _fold_state
+    _fold_state=state
+
+#Trains on fold i and returns its (tp,tn,fp,fn)
+def _eval_fold(i):
+    graph,order,k,seed,weighted=_fold_state
+    random.seed(seed+i)
+    np.random.seed(seed+i)
+    fold_graph=graph.fold(order,i,k)
+    tc=TriadClassifier(fold_graph,weighted)
+    tc.train()
+    node1s,node2s,weights=fold_graph.test_arrays()
+    pred=tc.classify_ids(node1s,node2s)
+    positive=1*weights>=0
+    tp=int(np.count_nonzero(positive&(pred[:,0]>pred[:,1])))
+    fn=int(np.count_nonzero(positive))-tp
+    tn=int(np.count_nonzero(~positive&(pred[:,0]<pred[:,1])))
+    fp=int(np.count_nonzero(~positive))-tn
+    return (tp,tn,fp,fn)
 
 if __name__=='__main__':
     tc=TriadClassifier(build_graph.build_graph('data/mlb/2015'))